@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the redaction layer of filtered_logger.
+
+Run `./benchmark.py -o results.json` for the machine-readable suite
+over filter_datum, RedactingFormatter.format and the get_logger path,
+or `./benchmark.py --tables` for the side-by-side comparisons.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import string
+import sys
+import timeit
+from typing import Callable, Dict, List
+
+from filtered_logger import (MATCHERS, PII_FIELDS, VALUE_PATTERNS,
+                             RedactingFormatter, filter_datum, get_logger,
+                             get_redactor)
+
+
+def legacy_filter_datum(fields: List[str],
+                        redaction: str,
+                        message: str,
+                        separator: str) -> str:
+    """
+    Original implementation of filter_datum, recompiling on every call.
+    """
+    pattern = '|'.join(f'{field}=[^{separator}]*' for field in fields)
+    return re.sub(pattern, lambda m: f"{m.group().split('=')[0]}={redaction}",
+                  message)
+
+
+def make_fields(count: int) -> List[str]:
+    """
+    Build a list of `count` field names.
+    """
+    return [f"field{i}" for i in range(count)]
+
+
+def make_random_fields(count: int, seed: int = 0) -> List[str]:
+    """
+    Build `count` distinct field names of 4 to 12 random letters, as
+    found in real compliance lists (no shared prefix).
+    """
+    rng = random.Random(seed)
+    fields = set()
+    while len(fields) < count:
+        size = rng.randint(4, 12)
+        fields.add(''.join(rng.choice(string.ascii_lowercase)
+                           for _ in range(size)))
+    return sorted(fields)
+
+
+def make_message(fields: List[str], length: int, separator: str) -> str:
+    """
+    Build a `key=value` log line of roughly `length` characters
+    cycling through the given fields.
+    """
+    parts = []
+    size = 0
+    i = 0
+    while size < length:
+        part = f"{fields[i % len(fields)]}=value{i}"
+        parts.append(part)
+        size += len(part) + 1
+        i += 1
+    return separator.join(parts) + separator
+
+
+def bench(func, fields: List[str], message: str, separator: str,
+          number: int) -> float:
+    """
+    Return the mean time in microseconds of one call to `func`.
+    """
+    timer = timeit.Timer(lambda: func(fields, "***", message, separator))
+    return min(timer.repeat(repeat=3, number=number)) / number * 1e6
+
+
+def bench_cache():
+    """
+    Compare legacy and cached filter_datum across sizes and field counts.
+    """
+    separator = ";"
+    print(f"{'fields':>6} {'length':>7} {'legacy us':>10} "
+          f"{'cached us':>10} {'speedup':>8}")
+    for field_count in (5, 20, 100):
+        fields = make_fields(field_count)
+        for length in (100, 1000, 10000):
+            message = make_message(fields, length, separator)
+            assert (legacy_filter_datum(fields, "***", message, separator) ==
+                    filter_datum(fields, "***", message, separator))
+            number = max(10, 200000 // length)
+            legacy = bench(legacy_filter_datum, fields, message,
+                           separator, number)
+            cached = bench(filter_datum, fields, message, separator, number)
+            print(f"{field_count:>6} {length:>7} {legacy:>10.2f} "
+                  f"{cached:>10.2f} {legacy / cached:>7.2f}x")
+
+
+def bench_matchers():
+    """
+    Compare regex and trie matcher throughput at 5, 50 and 500 fields.
+    """
+    separator = ";"
+    length = 1000
+    print(f"{'fields':>6} {'regex MB/s':>11} {'trie MB/s':>10}")
+    for field_count in (5, 50, 500):
+        fields = make_random_fields(field_count)
+        message = make_message(fields[:5] + ["ip", "user_agent"], length,
+                               separator)
+        results = []
+        for matcher in ("regex", "trie"):
+            redactor = get_redactor(fields, "***", separator, matcher)
+            timer = timeit.Timer(lambda: redactor.redact(message))
+            number = 500
+            best = min(timer.repeat(repeat=3, number=number)) / number
+            results.append(len(message) / best / 1e6)
+        print(f"{field_count:>6} {results[0]:>11.2f} {results[1]:>10.2f}")
+
+
+def bench_scanner():
+    """
+    Compare key-only redaction, key redaction followed by one extra
+    regex per value pattern, and the single-pass scanner.
+    """
+    separator = ";"
+    keys = get_redactor(PII_FIELDS, "***", separator)
+    scan = get_redactor(PII_FIELDS, "***", separator, "scan")
+    values = [re.compile(pattern) for pattern in VALUE_PATTERNS.values()]
+
+    def stacked(message: str) -> str:
+        message = keys.redact(message)
+        for pattern in values:
+            message = pattern.sub("***", message)
+        return message
+
+    formatter = RedactingFormatter(list(PII_FIELDS), "scan")
+    row = {"email": "bob@dylan.com", "note": "mail bob@dylan.com"}
+    assert formatter.serialize(row) == scan.redact(
+        "; ".join(f"{key}={value}" for key, value in row.items()) + ";")
+
+    print(f"{'length':>7} {'keys MB/s':>10} {'stacked MB/s':>13} "
+          f"{'scan MB/s':>10}")
+    for length in (100, 1000, 10000):
+        fields = list(PII_FIELDS) + ["ip", "note"]
+        message = make_message(fields, length, separator).replace(
+            "note=value", "note=mail bob@dylan.com or 555-123-4567 re ")
+        results = []
+        for func in (keys.redact, stacked, scan.redact):
+            timer = timeit.Timer(lambda: func(message))
+            number = max(10, 200000 // length)
+            best = min(timer.repeat(repeat=3, number=number)) / number
+            results.append(len(message) / best / 1e6)
+        print(f"{length:>7} {results[0]:>10.2f} {results[1]:>13.2f} "
+              f"{results[2]:>10.2f}")
+
+
+SUITE_LENGTHS = (100, 1000, 10000)
+SUITE_FIELD_COUNTS = (5, 50, 500)
+SUITE_SEPARATORS = (";", ",")
+SUITE_OCCURRENCES = (0.0, 0.5, 1.0)
+
+
+def make_case_message(fields: List[str], present: int, length: int,
+                      separator: str, seed: int = 0) -> str:
+    """
+    Build a `key=value` log line of roughly `length` characters where
+    the first `present` of `fields` occur, padded with non-sensitive
+    keys.
+    """
+    rng = random.Random(seed)
+    keys = list(fields[:present]) + [f"zz{i}" for i in range(8)]
+    rng.shuffle(keys)
+    parts = []
+    size = 0
+    i = 0
+    while size < length:
+        part = f"{keys[i % len(keys)]}=value{rng.randint(0, 99999)}"
+        parts.append(part)
+        size += len(part) + 1
+        i += 1
+    return separator.join(parts) + separator
+
+
+def measure(func: Callable[[], object], length: int) -> Dict[str, float]:
+    """
+    Time `func` and return per-call latency and throughput.
+    """
+    number = max(10, 100000 // length)
+    timer = timeit.Timer(func)
+    best = min(timer.repeat(repeat=5, number=number)) / number
+    return {"us_per_call": best * 1e6,
+            "mb_per_s": length / best / 1e6,
+            "calls": number}
+
+
+def run_suite() -> List[dict]:
+    """
+    Run every benchmark case and return one result dict per case.
+    """
+    results = []
+    record_args = ("user_data", logging.INFO, __file__, 0)
+    for field_count in SUITE_FIELD_COUNTS:
+        fields = make_random_fields(field_count)
+        for length in SUITE_LENGTHS:
+            for occurrence in SUITE_OCCURRENCES:
+                present = round(field_count * occurrence)
+                for separator in SUITE_SEPARATORS:
+                    message = make_case_message(fields, present, length,
+                                                separator)
+                    case = {"target": "filter_datum",
+                            "fields": field_count, "length": len(message),
+                            "separator": separator,
+                            "occurrence": occurrence}
+                    case.update(measure(
+                        lambda: filter_datum(fields, "***", message,
+                                             separator), len(message)))
+                    results.append(case)
+
+                message = make_case_message(fields, present, length, ";")
+                for matcher in MATCHERS:
+                    formatter = RedactingFormatter(fields, matcher)
+
+                    def format_record():
+                        record = logging.LogRecord(*record_args, message,
+                                                   None, None)
+                        return formatter.format(record)
+
+                    case = {"target": "RedactingFormatter.format",
+                            "matcher": matcher, "fields": field_count,
+                            "length": len(message), "separator": ";",
+                            "occurrence": occurrence}
+                    case.update(measure(format_record, len(message)))
+                    results.append(case)
+
+    logger = get_logger()
+    with open(os.devnull, "w") as devnull:
+        streams = [handler.setStream(devnull) for handler in logger.handlers]
+        try:
+            for length in SUITE_LENGTHS:
+                for occurrence in SUITE_OCCURRENCES:
+                    present = round(len(PII_FIELDS) * occurrence)
+                    message = make_case_message(list(PII_FIELDS), present,
+                                                length, ";")
+                    case = {"target": "get_logger",
+                            "fields": len(PII_FIELDS),
+                            "length": len(message), "separator": ";",
+                            "occurrence": occurrence}
+                    case.update(measure(lambda: logger.info(message),
+                                        len(message)))
+                    results.append(case)
+        finally:
+            for handler, stream in zip(logger.handlers, streams):
+                handler.setStream(stream)
+    return results
+
+
+def main():
+    """
+    Run the JSON suite, or the comparison tables with --tables.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-o", "--output",
+                        help="write JSON results to this file")
+    parser.add_argument("--tables", action="store_true",
+                        help="print the comparison tables instead")
+    args = parser.parse_args()
+
+    if args.tables:
+        bench_cache()
+        print()
+        bench_matchers()
+        print()
+        bench_scanner()
+        return
+
+    report = {"python": sys.version.split()[0],
+              "implementation": platform.python_implementation(),
+              "platform": platform.platform(),
+              "results": run_suite()}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,36 +3,164 @@
 Module for password hashing.
 """
 
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple
+
 import bcrypt
 
+# Target time of one hash, used to calibrate the bcrypt cost
+TARGET_HASH_SECONDS = float(os.getenv('BCRYPT_TARGET_SECONDS', '0.25'))
+# Never go below bcrypt's own default cost
+MIN_ROUNDS = 12
+MAX_ROUNDS = 31
+
+_rounds = None
+_rounds_lock = threading.Lock()
+
+
+def calibrate_rounds(target: float = TARGET_HASH_SECONDS,
+                     min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    """
+    Pick the bcrypt cost whose hash time is closest to `target` on
+    this machine.
+
+    A hash is timed at a cheap cost and extrapolated, each extra round
+    doubling the work.
+
+    Args:
+        target (float): Target hash time in seconds.
+        min_rounds (int): Lowest cost returned.
+        max_rounds (int): Highest cost returned.
+
+    Returns:
+        int: The bcrypt cost.
+    """
+    probe = 8
+    salt = bcrypt.gensalt(probe)
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", salt)
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    rounds = probe + round(math.log2(target / elapsed))
+    return max(min_rounds, min(max_rounds, rounds))
+
+
+def get_rounds() -> int:
+    """
+    Return the bcrypt cost for new hashes, calibrating it on first use.
+
+    Returns:
+        int: The bcrypt cost.
+    """
+    global _rounds
+    with _rounds_lock:
+        if _rounds is None:
+            _rounds = calibrate_rounds()
+        return _rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """
+    Return the cost a bcrypt hash was made with.
+
+    Args:
+        hashed_password (bytes): The hashed password.
+
+    Returns:
+        int: The bcrypt cost.
+    """
+    return int(hashed_password.split(b"$")[2])
+
 
-def hash_password(password: str) -> bytes:
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Tell whether a hash uses a lower cost than the calibrated one.
+
+    Args:
+        hashed_password (bytes): The hashed password.
+
+    Returns:
+        bool: True if the hash should be replaced.
+    """
+    return hash_rounds(hashed_password) < get_rounds()
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     Hash a password using bcrypt.
 
     Args:
         password (str): The password to hash.
+        rounds (int): bcrypt cost, the calibrated one if None.
 
     Returns:
         bytes: The hashed password.
     """
     # Generate a salt
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or get_rounds())
     # Hash the password with the generated salt
     hashed = bcrypt.hashpw(password.encode(), salt)
     return hashed
 
 
-def is_valid(hashed_password: bytes, password: str) -> bool:
+def is_valid(hashed_password: bytes, password: str,
+             on_rehash: Callable[[bytes], None] = None) -> bool:
     """
     Validate that the provided password matches the hashed password.
 
+    When the password matches and the stored hash uses an outdated
+    cost, a fresh hash at the calibrated cost is passed to `on_rehash`
+    so the caller can store it.
+
     Args:
         hashed_password (bytes): The hashed password.
         password (str): The plain text password.
+        on_rehash (Callable[[bytes], None]): Receives the new hash.
 
     Returns:
         bool: True if the password matches, False otherwise.
     """
     # Check if the hashed password matches the provided password
-    return bcrypt.checkpw(password.encode(), hashed_password)
+    valid = bcrypt.checkpw(password.encode(), hashed_password)
+    if valid and on_rehash is not None and needs_rehash(hashed_password):
+        on_rehash(hash_password(password))
+    return valid
+
+
+def hash_many(passwords: Iterable[str], workers: int = None) -> List[bytes]:
+    """
+    Hash several passwords in parallel.
+
+    bcrypt releases the GIL while hashing, so the work is spread over
+    a thread pool.
+
+    Args:
+        passwords (Iterable[str]): The passwords to hash.
+        workers (int): Pool size, `os.cpu_count()` if None.
+
+    Returns:
+        List[bytes]: The hashed passwords, in input order.
+    """
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return list(pool.map(hash_password, passwords))
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                workers: int = None) -> List[bool]:
+    """
+    Validate several (hashed_password, password) pairs in parallel.
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): Hashed and plain text
+            password pairs.
+        workers (int): Pool size, `os.cpu_count()` if None.
+
+    Returns:
+        List[bool]: Whether each pair matches, in input order.
+    """
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return list(pool.map(lambda pair: is_valid(*pair), pairs))
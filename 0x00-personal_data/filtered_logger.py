@@ -5,9 +5,24 @@ message and configure logger.
 """
 
 import re
+import atexit
+import glob
+import gzip
 import logging
-from typing import List, Tuple
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import (Any, Callable, Iterable, Iterator, List, Optional,
+                    Sequence, TextIO, Tuple, Union)
+import json
 import os
+import shutil
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import mysql.connector
 from mysql.connector import connection
 
@@ -37,29 +52,301 @@ def filter_datum(fields: List[str],
     Returns:
         str: The obfuscated log line.
     """
-    pattern = '|'.join(f'{field}=[^{separator}]*' for field in fields)
-    return re.sub(pattern, lambda m: f"{m.group().split('=')[0]}={redaction}",
-                  message)
+    return get_redactor(fields, redaction, separator).redact(message)
+
+
+class Redactor:
+    """
+    Redaction engine that obfuscates `field=value` pairs in a log line.
+
+    The alternation of all fields is compiled once into a single regex
+    with the key as its only group, so one `split` pass yields the text
+    between matches interleaved with the matched keys; the message is
+    then rebuilt with a single join and no per-match Python callback.
+    """
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str):
+        """
+        Compile the matcher for the given fields.
+
+        Args:
+            fields (Sequence[str]): Fields to obfuscate.
+            redaction (str): String to replace the field values with.
+            separator (str): Character separating the fields.
+        """
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        keys = '|'.join(re.escape(field) for field in self.fields)
+        self._pattern = re.compile(
+            f'({keys})=[^{re.escape(separator)}]*')
+        self._suffix = f"={redaction}"
+
+    def redact(self, message: str) -> str:
+        """
+        Return the message with every configured field obfuscated.
+
+        Args:
+            message (str): The log line to process.
+
+        Returns:
+            str: The obfuscated log line.
+        """
+        if not self.fields:
+            return message
+        parts = self._pattern.split(message)
+        if len(parts) == 1:
+            return message
+        suffix = self._suffix
+        parts[1::2] = [key + suffix for key in parts[1::2]]
+        return ''.join(parts)
+
+
+class TrieRedactor(Redactor):
+    """
+    Redaction engine matching field keys with a reversed-key trie.
+
+    Each `=` of the message is located with `str.find`, and the trie
+    of reversed field names is walked backwards from it; a hit redacts
+    the value up to the next separator. The cost per `=` is bounded by
+    the longest field name, so a single pass over the message handles
+    any number of configured fields. Output is identical to the regex
+    engine for field names that contain neither `=` nor the separator.
+    """
+
+    _END = ""
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str):
+        """
+        Build the reversed-key trie for the given fields.
+
+        Args:
+            fields (Sequence[str]): Fields to obfuscate.
+            redaction (str): String to replace the field values with.
+            separator (str): Character separating the fields.
+        """
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self._trie = {}
+        for field in self.fields:
+            node = self._trie
+            for char in reversed(field):
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def redact(self, message: str) -> str:
+        """
+        Return the message with every configured field obfuscated.
+
+        Args:
+            message (str): The log line to process.
+
+        Returns:
+            str: The obfuscated log line.
+        """
+        find = message.find
+        pos = find("=")
+        if pos < 0 or not self.fields:
+            return message
+        trie = self._trie
+        end_key = self._END
+        separator = self.separator
+        parts = []
+        last = 0
+        while pos >= 0:
+            node = trie
+            i = pos - 1
+            while i >= last:
+                node = node.get(message[i])
+                if node is None or end_key in node:
+                    break
+                i -= 1
+            if node is not None and end_key in node:
+                end = find(separator, pos + 1)
+                if end < 0:
+                    end = len(message)
+                parts.append(message[last:pos + 1])
+                parts.append(self.redaction)
+                last = end
+                pos = find("=", end)
+            else:
+                pos = find("=", pos + 1)
+        if not parts:
+            return message
+        parts.append(message[last:])
+        return "".join(parts)
+
+
+VALUE_PATTERNS = {
+    "email": r"(?<![\w.+-])[\w.+-]+@[\w-]+(?:\.[\w-]+)+",
+    "ssn": r"\b\d{3}-\d{2}-\d{4}\b",
+    "phone": r"(?:\(\d{3}\) ?|\b\d{3}[-. ])\d{3}[-. ]\d{4}\b",
+}
+
+
+class ScanRedactor(Redactor):
+    """
+    Redaction engine that also catches PII values in free text.
+
+    Configured `field=` keys and the `VALUE_PATTERNS` (emails, SSNs,
+    phone numbers) are alternatives of one compiled regex, so a single
+    `split` pass finds both: a key match keeps the key and redacts its
+    value, a value match is replaced by the redaction as a whole.
+    """
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str):
+        """
+        Compile the combined key and value matcher.
+
+        Args:
+            fields (Sequence[str]): Fields to obfuscate.
+            redaction (str): String to replace the field values with.
+            separator (str): Character separating the fields.
+        """
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        values = '|'.join(VALUE_PATTERNS.values())
+        self._values = re.compile(values)
+        if self.fields:
+            keys = '|'.join(re.escape(field) for field in self.fields)
+            self._pattern = re.compile(
+                f'({keys})=[^{re.escape(separator)}]*|({values})')
+        else:
+            self._pattern = re.compile(f'()(?!)|({values})')
+        self._suffix = f"={redaction}"
+
+    def redact(self, message: str) -> str:
+        """
+        Return the message with configured fields and PII values
+        obfuscated.
+
+        Args:
+            message (str): The log line to process.
+
+        Returns:
+            str: The obfuscated log line.
+        """
+        parts = self._pattern.split(message)
+        if len(parts) == 1:
+            return message
+        suffix = self._suffix
+        redaction = self.redaction
+        parts[1::3] = [redaction if key is None else key + suffix
+                       for key in parts[1::3]]
+        parts[2::3] = [''] * (len(parts) // 3)
+        return ''.join(parts)
+
+    def redact_values(self, text: str) -> str:
+        """
+        Return the text with its PII values obfuscated, keys aside.
+
+        Args:
+            text (str): A field value.
+
+        Returns:
+            str: The obfuscated value.
+        """
+        return self._values.sub(self.redaction, text)
+
+
+MATCHERS = {
+    "regex": Redactor,
+    "trie": TrieRedactor,
+    "scan": ScanRedactor,
+}
+
+
+@lru_cache(maxsize=128)
+def _cached_redactor(fields: Tuple[str, ...], redaction: str,
+                     separator: str, matcher: str) -> Redactor:
+    """
+    Build a redaction engine, memoized per configuration.
+    """
+    return MATCHERS[matcher](fields, redaction, separator)
+
+
+def get_redactor(fields: Sequence[str], redaction: str,
+                 separator: str, matcher: str = "regex") -> Redactor:
+    """
+    Return the compiled Redactor for a field/redaction/separator set.
+
+    Compiled engines are kept in a bounded LRU cache so repeated calls
+    with the same configuration never recompile the regex.
+
+    Args:
+        fields (Sequence[str]): Fields to obfuscate.
+        redaction (str): String to replace the field values with.
+        separator (str): Character separating the fields.
+        matcher (str): Engine name, a key of `MATCHERS`.
+
+    Returns:
+        Redactor: The compiled redaction engine.
+    """
+    if matcher not in MATCHERS:
+        raise ValueError(f"unknown matcher: {matcher}")
+    return _cached_redactor(tuple(fields), redaction, separator, matcher)
 
 
 class RedactingFormatter(logging.Formatter):
     """
     Redacting Formatter class for obfuscating sensitive
     information in log messages.
+
+    A record whose `msg` is a mapping, or that carries a mapping in
+    its `fields` attribute (`extra={"fields": {...}}`), is redacted by
+    key lookup and serialized once as `key=value; ` pairs, the format
+    of the export lines, instead of being regex-scanned.
     """
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], matcher: str = "regex"):
         """
         Initialize the formatter with specific fields to redact.
 
         Args:
             fields (List[str]): List of fields to obfuscate.
+            matcher (str): Redaction engine, a key of `MATCHERS`: the
+                trie scales better to hundreds of fields, the scanner
+                also redacts emails, SSNs and phone numbers in free
+                text.
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._redactor = get_redactor(fields, self.REDACTION, self.SEPARATOR,
+                                      matcher)
+        self._field_set = frozenset(fields)
+
+    def serialize(self, data: Mapping) -> str:
+        """
+        Serialize a mapping as `key=value; ` pairs ending with the
+        separator, redacting PII keys, and PII values of the other keys
+        with the scan matcher.
+
+        Args:
+            data (Mapping): The structured log payload.
+
+        Returns:
+            str: The redacted message.
+        """
+        redaction = self.REDACTION
+        separator = self.SEPARATOR
+        field_set = self._field_set
+        if isinstance(self._redactor, ScanRedactor):
+            scan = self._redactor.redact_values
+            return f"{separator} ".join(
+                f"{key}={redaction}" if key in field_set
+                else f"{key}={scan(str(value))}"
+                for key, value in data.items()) + separator
+        return f"{separator} ".join(
+            f"{key}={redaction if key in field_set else value}"
+            for key, value in data.items()) + separator
 
     def format(self, record: logging.LogRecord) -> str:
         """
@@ -71,17 +358,319 @@ class RedactingFormatter(logging.Formatter):
         Returns:
             str: The formatted log record with obfuscated fields.
         """
-        record.msg = filter_datum(self.fields,
-                                  self.REDACTION,
-                                  record.msg,
-                                  self.SEPARATOR)
+        data = getattr(record, "fields", None)
+        if isinstance(record.msg, Mapping):
+            record.msg = self.serialize(record.msg)
+        elif isinstance(data, Mapping):
+            message = self._redactor.redact(str(record.msg))
+            record.msg = " ".join(filter(None, (message,
+                                                self.serialize(data))))
+        else:
+            record.msg = self._redactor.redact(record.msg)
         return super(RedactingFormatter, self).format(record)
 
 
-def get_logger() -> logging.Logger:
+class RedactingQueueHandler(QueueHandler):
+    """
+    Queue handler that only enqueues records on the caller's thread.
+
+    Formatting, redaction and I/O are left to the attached
+    `RedactingQueueListener`. When the bounded queue is full, records
+    are dropped, or the caller blocks if `block` is True.
+    """
+
+    def __init__(self, maxsize: int = 10000, block: bool = False):
+        """
+        Initialize the handler over a new bounded queue.
+
+        Args:
+            maxsize (int): Queue capacity.
+            block (bool): Block instead of dropping when full.
+        """
+        super(RedactingQueueHandler, self).__init__(queue.Queue(maxsize))
+        self.block = block
+        self.enqueued = 0
+        self.dropped = 0
+        self.counters_lock = threading.Lock()
+        self.listener = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Enqueue the record untouched; the listener formats it.
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Put the record on the queue according to the full-queue policy.
+
+        The counters are updated under a lock, since any number of
+        threads may log through the handler at once.
+        """
+        try:
+            self.queue.put(record, block=self.block)
+        except queue.Full:
+            with self.counters_lock:
+                self.dropped += 1
+            return
+        with self.counters_lock:
+            self.enqueued += 1
+
+    def stats(self) -> dict:
+        """
+        Return the enqueued, dropped and flushed record counters.
+        """
+        flushed = self.listener.flushed if self.listener else 0
+        with self.counters_lock:
+            return {"enqueued": self.enqueued, "dropped": self.dropped,
+                    "flushed": flushed}
+
+
+class RedactingQueueListener(QueueListener):
+    """
+    Background listener running the redacting handlers of a queue.
+    """
+
+    def __init__(self, queue_handler: RedactingQueueHandler,
+                 *handlers: logging.Handler):
+        """
+        Initialize the listener and attach it to its queue handler.
+        """
+        super(RedactingQueueListener, self).__init__(
+            queue_handler.queue, *handlers, respect_handler_level=True)
+        self.flushed = 0
+        queue_handler.listener = self
+
+    def handle(self, record: logging.LogRecord) -> None:
+        """
+        Format and write one record, then count it.
+        """
+        super(RedactingQueueListener, self).handle(record)
+        self.flushed += 1
+
+    def enqueue_sentinel(self) -> None:
+        """
+        Enqueue the stop sentinel, waiting for room if the queue is full.
+        """
+        self.queue.put(self._sentinel)
+
+
+class BatchingFileHandler(logging.Handler):
+    """
+    File handler buffering formatted records and writing them in
+    large chunks.
+
+    The buffer is flushed once it holds `flush_size` bytes, and at
+    least every `flush_interval` seconds by a background thread. The
+    file is rotated to `<filename>.<n>` before it would exceed
+    `max_bytes`, and rotated segments are gzipped on a background
+    thread, keeping at most `backup_count` of them (0 keeps all).
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 64 * 1024 * 1024,
+                 flush_size: int = 256 * 1024, flush_interval: float = 1.0,
+                 backup_count: int = 0, compress: bool = True):
+        """
+        Open the log file and start the flusher thread.
+
+        Args:
+            filename (str): Path of the active log file.
+            max_bytes (int): Rotation size, 0 to never rotate.
+            flush_size (int): Buffered bytes triggering a write.
+            flush_interval (float): Max seconds a record stays buffered.
+            backup_count (int): Rotated segments kept, 0 for all.
+            compress (bool): Gzip rotated segments.
+        """
+        super(BatchingFileHandler, self).__init__()
+        self.baseFilename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self._buffer = []
+        self._buffered = 0
+        self._file = open(self.baseFilename, "ab")
+        self._size = self._file.tell()
+        self._segment = max(self._segments() or [0])
+        self._compressor = ThreadPoolExecutor(max_workers=1)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop,
+                                         daemon=True)
+        self._flusher.start()
+
+    def _segments(self) -> List[int]:
+        """
+        Return the sorted indexes of the existing rotated segments.
+        """
+        indexes = set()
+        for path in glob.glob(f"{glob.escape(self.baseFilename)}.*"):
+            suffix = path[len(self.baseFilename) + 1:]
+            if suffix.endswith(".gz"):
+                suffix = suffix[:-3]
+            if suffix.isdigit():
+                indexes.add(int(suffix))
+        return sorted(indexes)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Format the record and add it to the buffer.
+        """
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        self.write_lines([line])
+
+    def write_lines(self, lines: List[str]) -> None:
+        """
+        Buffer already formatted lines, writing them out once the
+        buffer reaches `flush_size`.
+
+        Args:
+            lines (List[str]): Lines without trailing newline.
+        """
+        data = ("\n".join(lines) + "\n").encode()
+        self.acquire()
+        try:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.flush_size:
+                self._write_buffer()
+        finally:
+            self.release()
+
+    def _write_buffer(self) -> None:
+        """
+        Write the buffer in one call, rotating first if needed.
+        Must be called with the handler lock held.
+        """
+        if not self._buffer:
+            return
+        data = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if self.max_bytes and self._size and \
+                self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def _rotate(self) -> None:
+        """
+        Move the active file to the next segment and reopen it.
+        """
+        self._file.close()
+        self._segment += 1
+        segment = f"{self.baseFilename}.{self._segment}"
+        os.replace(self.baseFilename, segment)
+        self._file = open(self.baseFilename, "ab")
+        self._size = 0
+        if self.compress:
+            self._compressor.submit(self._compress, segment)
+        else:
+            self._prune()
+
+    def _compress(self, segment: str) -> None:
+        """
+        Gzip a rotated segment, then prune old segments.
+        """
+        with open(segment, "rb") as src, \
+                gzip.open(f"{segment}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(segment)
+        self._prune()
+
+    def _prune(self) -> None:
+        """
+        Delete the oldest segments beyond `backup_count`.
+        """
+        if not self.backup_count:
+            return
+        for index in self._segments()[:-self.backup_count]:
+            for path in (f"{self.baseFilename}.{index}",
+                         f"{self.baseFilename}.{index}.gz"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _flush_loop(self) -> None:
+        """
+        Flush the buffer every `flush_interval` seconds until closed.
+        """
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write out everything buffered.
+        """
+        self.acquire()
+        try:
+            if not self._file.closed:
+                self._write_buffer()
+        finally:
+            self.release()
+
+    def sync(self) -> None:
+        """
+        Write out everything buffered and fsync it to disk.
+        """
+        self.acquire()
+        try:
+            if not self._file.closed:
+                self._write_buffer()
+                os.fsync(self._file.fileno())
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        """
+        Flush, stop the flusher and wait for pending compressions.
+        """
+        self._stop.set()
+        self.acquire()
+        try:
+            if not self._file.closed:
+                self._write_buffer()
+                self._file.close()
+        finally:
+            self.release()
+        self._compressor.shutdown(wait=True)
+        super(BatchingFileHandler, self).close()
+
+
+def _close_handlers(logger: logging.Logger) -> None:
+    """
+    Detach every handler of the logger, stopping queue listeners.
+    """
+    for handler in list(logger.handlers):
+        listener = getattr(handler, "listener", None)
+        if listener is not None and listener._thread is not None:
+            listener.stop()
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def get_logger(queued: bool = False, maxsize: int = 10000,
+               block: bool = False,
+               filename: str = None) -> logging.Logger:
     """
     Get a logger configured with RedactingFormatter.
 
+    Calling it again with the same mode returns the logger as is
+    instead of stacking another handler. In queued mode the caller only
+    enqueues records; a background listener redacts and writes them.
+    With a `filename`, records go to a `BatchingFileHandler` instead
+    of stderr.
+
+    Args:
+        queued (bool): Use a queue handler and background listener.
+        maxsize (int): Queue capacity in queued mode.
+        block (bool): Block instead of dropping when the queue is full.
+        filename (str): Batched, rotating log file to write to.
+
     Returns:
         logging.Logger: Configured logger.
     """
@@ -89,21 +678,89 @@ def get_logger() -> logging.Logger:
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
-    handler = logging.StreamHandler()
+    if queued:
+        wanted = RedactingQueueHandler
+    elif filename:
+        wanted = BatchingFileHandler
+    else:
+        wanted = logging.StreamHandler
+    if any(type(handler) is wanted for handler in logger.handlers):
+        return logger
+    _close_handlers(logger)
+
+    if filename:
+        handler = BatchingFileHandler(filename)
+        atexit.register(handler.close)
+    else:
+        handler = logging.StreamHandler()
     handler.setFormatter(RedactingFormatter(fields=list(PII_FIELDS)))
 
+    if queued:
+        queue_handler = RedactingQueueHandler(maxsize, block)
+        RedactingQueueListener(queue_handler, handler).start()
+        atexit.register(_close_handlers, logger)
+        handler = queue_handler
+
     logger.addHandler(handler)
 
     return logger
 
 
-def get_db() -> connection.MySQLConnection:
+def logger_stats(logger: logging.Logger) -> dict:
+    """
+    Return the queue counters of a queued logger.
+
+    Args:
+        logger (logging.Logger): Logger returned by `get_logger`.
+
+    Returns:
+        dict: Summed `enqueued`, `dropped` and `flushed` counters.
+    """
+    stats = {"enqueued": 0, "dropped": 0, "flushed": 0}
+    for handler in logger.handlers:
+        if isinstance(handler, RedactingQueueHandler):
+            for key, value in handler.stats().items():
+                stats[key] += value
+    return stats
+
+
+def stream_handlers(logger: logging.Logger) -> List[logging.Handler]:
+    """
+    Return the stream and batching file handlers a logger ultimately
+    writes to, looking through queue handlers to their listener's
+    handlers.
+
+    Args:
+        logger (logging.Logger): Logger returned by `get_logger`.
+
+    Returns:
+        List[logging.Handler]: The target handlers.
+    """
+    handlers = []
+    for handler in logger.handlers:
+        listener = getattr(handler, "listener", None)
+        targets = listener.handlers if listener else (handler,)
+        handlers.extend(target for target in targets
+                        if isinstance(target, (logging.StreamHandler,
+                                               BatchingFileHandler)))
+    return handlers
+
+
+def get_db() -> Union[connection.MySQLConnection, sqlite3.Connection]:
     """
     Connect to the database using credentials from environment variables.
 
+    If `PERSONAL_DATA_DB_PATH` is set, the SQLite database at that path
+    is opened instead of the MySQL server, e.g. to run the export
+    locally.
+
     Returns:
-        mysql.connector.connection.MySQLConnection: Database connection object.
+        mysql.connector.connection.MySQLConnection: Database connection object,
+        or a sqlite3.Connection.
     """
+    db_path = os.getenv('PERSONAL_DATA_DB_PATH')
+    if db_path:
+        return sqlite3.connect(db_path)
     username = os.getenv('PERSONAL_DATA_DB_USERNAME', 'root')
     password = os.getenv('PERSONAL_DATA_DB_PASSWORD', 'root')
     host = os.getenv('PERSONAL_DATA_DB_HOST', 'localhost')
@@ -117,21 +774,433 @@ def get_db() -> connection.MySQLConnection:
     )
 
 
-def main():
+EXPORT_BATCH_SIZE = 1000
+CHECKPOINT_FILE = os.getenv('PERSONAL_DATA_CHECKPOINT', '.export_checkpoint')
+
+
+def stream_cursor(db: Any) -> Any:
     """
-    Main function to fetch and log user data from the database.
+    Open a cursor that streams rows from the server instead of
+    buffering the whole result set client side.
+
+    Args:
+        db: A DB-API connection, as returned by `get_db`.
+
+    Returns:
+        A cursor on the connection.
     """
-    db = get_db()
+    try:
+        return db.cursor(buffered=False)
+    except TypeError:
+        return db.cursor()
+
+
+def iter_rows(cursor: Any,
+              batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Tuple]:
+    """
+    Yield the rows of an executed cursor, `batch_size` at a time.
+
+    Args:
+        cursor: A cursor on which a query has been executed.
+        batch_size (int): Number of rows fetched per round trip.
+
+    Yields:
+        tuple: One row of the result set.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def row_record(name: str, columns: Sequence[str],
+               row: Sequence[Any]) -> logging.LogRecord:
+    """
+    Build the INFO log record of a users row.
+
+    The row is passed as a mapping so `RedactingFormatter` redacts it
+    by key lookup rather than re-parsing a `key=value` string.
+
+    Args:
+        name (str): Logger name stamped on the record.
+        columns (Sequence[str]): Column names of the row.
+        row (Sequence[Any]): Column values.
+
+    Returns:
+        logging.LogRecord: The record.
+    """
+    return logging.LogRecord(name, logging.INFO, __file__, 0,
+                             dict(zip(columns, row)), None, None)
+
+
+def iter_records(cursor: Any, name: str = "user_data",
+                 batch_size: int = EXPORT_BATCH_SIZE
+                 ) -> Iterator[logging.LogRecord]:
+    """
+    Yield one INFO log record per row of an executed cursor.
+
+    Args:
+        cursor: A cursor on which a query has been executed.
+        name (str): Logger name stamped on each record.
+        batch_size (int): Number of rows fetched per round trip.
+
+    Yields:
+        logging.LogRecord: The record holding the row message.
+    """
+    columns = [col[0] for col in cursor.description]
+    for row in iter_rows(cursor, batch_size):
+        yield row_record(name, columns, row)
+
+
+def iter_formatted(records: Iterable[logging.LogRecord],
+                   handlers: Sequence[logging.Handler]
+                   ) -> Iterator[List[str]]:
+    """
+    Yield, for each record, its formatted (redacted) line per handler.
+
+    Args:
+        records (Iterable[logging.LogRecord]): Records to format.
+        handlers (Sequence[logging.Handler]): Handlers whose formatters
+            are applied, in order.
+
+    Yields:
+        List[str]: One line per handler.
+    """
+    for record in records:
+        yield [handler.format(record) for handler in handlers]
+
+
+def _write_lines(handler: logging.Handler, lines: List[str]) -> None:
+    """
+    Write lines to a stream or batching file handler in a single call.
+    """
+    if isinstance(handler, BatchingFileHandler):
+        handler.write_lines(lines)
+        return
+    handler.acquire()
+    try:
+        handler.stream.write(
+            handler.terminator.join(lines) + handler.terminator)
+        handler.flush()
+    finally:
+        handler.release()
+
+
+def write_batched(records: Iterable[logging.LogRecord],
+                  handlers: Sequence[logging.Handler],
+                  batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    Format records through each handler and write them `batch_size`
+    lines at a time instead of one write per record.
+
+    Args:
+        records (Iterable[logging.LogRecord]): Records to write.
+        handlers (Sequence[logging.Handler]): Target handlers.
+        batch_size (int): Number of lines per write.
+
+    Returns:
+        int: Number of records written.
+    """
+    count = 0
+    batches = [[] for _ in handlers]
+    for lines in iter_formatted(records, handlers):
+        count += 1
+        for batch, line in zip(batches, lines):
+            batch.append(line)
+        if batches and len(batches[0]) >= batch_size:
+            for handler, batch in zip(handlers, batches):
+                _write_lines(handler, batch)
+                batch.clear()
+    for handler, batch in zip(handlers, batches):
+        if batch:
+            _write_lines(handler, batch)
+    return count
+
+
+def export_users(db: Any, logger: logging.Logger = None,
+                 batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    Stream the users table through the logger's redacting handlers.
+
+    Rows are fetched `batch_size` at a time from an unbuffered cursor,
+    formatted and redacted lazily, and written to each stream handler
+    in batches, so memory stays constant whatever the table size.
+
+    Args:
+        db: A DB-API connection, as returned by `get_db`.
+        logger (logging.Logger): Target logger, `get_logger()` if None.
+        batch_size (int): Rows per fetch and lines per write.
+
+    Returns:
+        int: Number of rows exported.
+    """
+    if logger is None:
+        logger = get_logger()
+    handlers = stream_handlers(logger)
+    cursor = stream_cursor(db)
+    try:
+        cursor.execute("SELECT * FROM users;")
+        records = iter_records(cursor, logger.name, batch_size)
+        if not handlers:
+            return sum(1 for _ in records)
+        return write_batched(records, handlers, batch_size)
+    finally:
+        cursor.close()
+
+
+def _export_range(connect: Callable[[], Any], key: str, low: Any,
+                  high: Any, path: str, batch_size: int) -> int:
+    """
+    Worker: export the users whose `key` is in [low, high) to a shard.
+
+    A None bound leaves that side open; the range without a lower bound
+    also takes the rows whose key is NULL. Opens its own connection
+    through `connect` and reads in its own consistent snapshot, so
+    nothing but the arguments crosses process boundaries.
+    """
+    db = connect()
+    try:
+        mark = _placeholder(db)
+        clauses, params = [], []
+        if low is not None:
+            clauses.append(f"{key} >= {mark}")
+            params.append(low)
+        if high is not None:
+            clauses.append(f"{key} < {mark}")
+            params.append(high)
+        if low is None and clauses:
+            clauses.append(f"{key} IS NULL")
+        where = (" OR " if low is None else " AND ").join(clauses)
+        query = "SELECT * FROM users"
+        if where:
+            query += f" WHERE {where}"
+        _begin_snapshot(db)
+        cursor = stream_cursor(db)
+        try:
+            cursor.execute(f"{query} ORDER BY {key};", tuple(params))
+            with open(path, "w") as shard:
+                handler = logging.StreamHandler(shard)
+                handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+                records = iter_records(cursor, "user_data", batch_size)
+                return write_batched(records, [handler], batch_size)
+        finally:
+            cursor.close()
+    finally:
+        db.close()
+
+
+def _key_bounds(db: Any, key: str, parts: int) -> List[Any]:
+    """
+    Return the ascending, distinct values of `key` splitting the users
+    table into at most `parts` ranges of about the same row count.
+    """
+    _begin_snapshot(db)
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM users;")
-    logger = get_logger()
+    cursor.execute(f"SELECT COUNT({key}) FROM users;")
+    total = cursor.fetchone()[0]
+    cursor.close()
+    size = -(-total // parts) or 1
+    bounds = []
+    cursor = stream_cursor(db)
+    try:
+        cursor.execute(f"SELECT {key} FROM users WHERE {key} IS NOT NULL "
+                       f"ORDER BY {key};")
+        for position, row in enumerate(iter_rows(cursor)):
+            if position and position % size == 0 and \
+                    (not bounds or row[0] != bounds[-1]):
+                bounds.append(row[0])
+    finally:
+        cursor.close()
+    return bounds
+
+
+def export_users_parallel(shard_prefix: str, workers: int = None,
+                          connect: Callable[[], Any] = get_db,
+                          key: str = "email",
+                          stream: TextIO = None,
+                          batch_size: int = EXPORT_BATCH_SIZE) -> List[str]:
+    """
+    Export the users table over a process pool, one key range
+    per worker.
+
+    The coordinator reads `key` once, in order, to split the table into
+    `workers` ranges of about the same size; each worker then selects
+    its range with keyset predicates on `key`, which should be indexed,
+    in its own consistent snapshot, and writes it redacted to
+    `<shard_prefix>.<index>.log`. Ranges are bounded by key values, so
+    a row belongs to exactly one of them and writes to the table are
+    never blocked. If `stream` is given, the shards are then
+    concatenated into it in range order and removed.
+
+    Args:
+        shard_prefix (str): Path prefix of the shard files.
+        workers (int): Number of processes, `os.cpu_count()` if None.
+        connect (Callable): Picklable connection factory for workers.
+        key (str): Column the table is partitioned and ordered on.
+        stream (TextIO): Optional stream receiving the merged output.
+        batch_size (int): Rows per fetch and lines per write.
+
+    Returns:
+        List[str]: Paths of the shard files, empty if merged.
+    """
+    if not re.fullmatch(r"\w+", key):
+        raise ValueError(f"invalid column name: {key}")
+    workers = workers or os.cpu_count() or 1
+    db = connect()
+    try:
+        bounds = _key_bounds(db, key, workers)
+    finally:
+        db.close()
+
+    ranges = list(zip([None] + bounds, bounds + [None]))
+    paths = [f"{shard_prefix}.{i:04d}.log" for i in range(len(ranges))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_export_range, connect, key, low, high,
+                               path, batch_size)
+                   for (low, high), path in zip(ranges, paths)]
+        for future in futures:
+            future.result()
+
+    if stream is None:
+        return paths
+    for path in paths:
+        with open(path) as shard:
+            shutil.copyfileobj(shard, stream)
+        os.remove(path)
+    stream.flush()
+    return []
 
-    for row in cursor:
-        message = f"name={row[0]}; email={row[1]}; phone={row[2]}; ssn={row[3]}; password={row[4]}; ip={row[5]}; last_login={row[6]}; user_agent={row[7]}"
-        logger.info(message)
 
+def _begin_snapshot(db: Any) -> None:
+    """
+    Start a read transaction whose reads all see the same snapshot of
+    the database, without blocking writers.
+    """
+    cursor = db.cursor()
+    if _placeholder(db) == "?":
+        cursor.execute("BEGIN;")
+    else:
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT;")
     cursor.close()
-    db.close()
+
+
+def load_checkpoint(path: str = CHECKPOINT_FILE) -> Optional[dict]:
+    """
+    Read the incremental export checkpoint.
+
+    Args:
+        path (str): Checkpoint file path.
+
+    Returns:
+        dict: `{"last_login": ..., "key": ...}`, or None if no
+        export has completed a batch yet.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(last_login: Any, key: Any,
+                    path: str = CHECKPOINT_FILE) -> None:
+    """
+    Atomically replace the incremental export checkpoint.
+
+    Args:
+        last_login: `last_login` of the last exported row.
+        key: `email` of the last exported row, breaking ties.
+        path (str): Checkpoint file path.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"last_login": str(last_login), "key": str(key)}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _placeholder(db: Any) -> str:
+    """
+    Return the query parameter placeholder of a DB-API connection.
+    """
+    module = sys.modules.get(type(db).__module__.split(".")[0])
+    if getattr(module, "paramstyle", None) == "qmark":
+        return "?"
+    return "%s"
+
+
+def export_users_incremental(db: Any, logger: logging.Logger = None,
+                             path: str = CHECKPOINT_FILE,
+                             batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    Export only the users whose `last_login` moved past the checkpoint.
+
+    Rows are read in `(last_login, email)` order; after each batch is
+    written and flushed (fsynced for batching file handlers) the
+    checkpoint is advanced to its last row, so
+    an interrupted run resumes where it stopped, re-exporting at most
+    one batch. Without a checkpoint the whole table is exported.
+
+    Args:
+        db: A DB-API connection, as returned by `get_db`.
+        logger (logging.Logger): Target logger, `get_logger()` if None.
+        path (str): Checkpoint file path.
+        batch_size (int): Rows per fetch and lines per write.
+
+    Returns:
+        int: Number of rows exported.
+    """
+    if logger is None:
+        logger = get_logger()
+    handlers = stream_handlers(logger)
+    checkpoint = load_checkpoint(path)
+    cursor = stream_cursor(db)
+    try:
+        if checkpoint is None:
+            cursor.execute("SELECT * FROM users ORDER BY last_login, email;")
+        else:
+            mark = _placeholder(db)
+            cursor.execute(
+                "SELECT * FROM users WHERE last_login > {0} OR "
+                "(last_login = {0} AND email > {0}) "
+                "ORDER BY last_login, email;".format(mark),
+                (checkpoint["last_login"], checkpoint["last_login"],
+                 checkpoint["key"]))
+        columns = [col[0] for col in cursor.description]
+        login_index = columns.index("last_login")
+        key_index = columns.index("email")
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return count
+            records = (row_record(logger.name, columns, row)
+                       for row in rows)
+            count += write_batched(records, handlers, batch_size)
+            for handler in handlers:
+                # The checkpoint must not get ahead of the log on disk
+                if isinstance(handler, BatchingFileHandler):
+                    handler.sync()
+                else:
+                    handler.flush()
+            last = rows[-1]
+            if last[login_index] is not None:
+                save_checkpoint(last[login_index], last[key_index], path)
+    finally:
+        cursor.close()
+
+
+def main():
+    """
+    Main function to fetch and log user data from the database.
+    """
+    db = get_db()
+    try:
+        export_users(db)
+    finally:
+        db.close()
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -9,11 +9,71 @@ from models.user import User
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - order_by: id, created_at, updated_at, email, first_name or
+        last_name (default id once paged), desc=1 for descending order
+      - limit and offset: page of the list
+      - after: cursor of the next page, from the X-Next-Cursor header
+        of a full page
+      - created_at_from, created_at_to, updated_at_from and
+        updated_at_to: ISO timestamp range (from included, to excluded)
     Return:
-      - list of all User objects JSON represented
+      - list of all (or the page of) User objects JSON represented
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    args = request.args
+    ranges = {}
+    for attr in ('created_at', 'updated_at'):
+        low = args.get('{}_from'.format(attr))
+        high = args.get('{}_to'.format(attr))
+        if low is not None or high is not None:
+            ranges[attr] = (low, high)
+    if not ranges and not any(name in args for name in (
+            'order_by', 'desc', 'limit', 'offset', 'after')):
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    order_by = args.get('order_by', next(iter(ranges), 'id'))
+    if order_by not in ('id', 'created_at', 'updated_at', 'email',
+                        'first_name', 'last_name'):
+        return jsonify({'error': "Wrong order_by"}), 400
+    try:
+        limit = int(args['limit']) if 'limit' in args else None
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        limit = offset = -1
+    if offset < 0 or (limit is not None and limit < 0):
+        return jsonify({'error': "Wrong limit or offset"}), 400
+    try:
+        users = list(User.query(ranges=ranges, order_by=order_by,
+                                descending=args.get('desc') == '1',
+                                offset=offset, limit=limit,
+                                after=args.get('after')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify([user.to_json() for user in users])
+    if limit and len(users) == limit:
+        response.headers['X-Next-Cursor'] = User.cursor(users[-1], order_by)
+    return response
+
+
+@app_views.route('/users/search', methods=['GET'], strict_slashes=False)
+def search_users() -> str:
+    """ GET /api/v1/users/search
+    Query parameters:
+      - q: substring to look for in email, first_name and last_name
+      - prefix (optional): "1" to match the start of the fields only
+    Return:
+      - list of matching User objects JSON represented
+      - 400 if q is missing
+    """
+    query = request.args.get('q', '')
+    if query == '':
+        return jsonify({'error': "q missing"}), 400
+    prefix = request.args.get('prefix') == '1'
+    users = [user.to_json() for user in User.text_search(query,
+                                                         prefix=prefix)]
+    return jsonify(users)
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the Base snapshot formats.
+
+Run `python3 -m models.benchmark -n 100000` from the project root to
+compare file size, save and load time of each serializer, both for
+the serializer alone and through User.save_to_file/load_from_file,
+or `python3 -m models.benchmark -n 1000000 --memory` for the memory
+held per user by the dict, the compact (BASE_COMPACT=1) and the mapped
+(BASE_MAPPED=1) stores, the pages of the latter being shared by all
+processes mapping the snapshot and not counted.
+"""
+
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+import models.base as base
+from models.serializers import SERIALIZERS
+from models.user import User
+
+
+def make_users(count: int):
+    """
+    Fill the User store with `count` users.
+    """
+    base.DATA["User"] = {}
+    base.INDEXES["User"] = None
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i % 1000),
+                    last_name=None if i % 4 == 0 else "Last{}".format(i))
+        user.password = "password{}".format(i)
+        base.DATA["User"][user.id] = user
+
+
+def best(func: Callable[[], object], repeat: int = 3) -> float:
+    """
+    Return the best wall time of `repeat` calls to `func`, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_memory(count: int):
+    """
+    Print the memory held per user once loaded, per store.
+    """
+    make_users(count)
+    base.SERIALIZER = "binary"
+    User.save_to_file()
+    base.MAPPED = True
+    User.load_from_file()
+    base.DATA["User"] = {}
+    gc.collect()
+    print("{} users".format(count))
+    print(f"{'store':>8} {'MB':>8} {'bytes/user':>11} {'load s':>7}")
+    for name in ("dict", "compact", "mapped"):
+        base.COMPACT = name == "compact"
+        base.MAPPED = name == "mapped"
+        tracemalloc.start()
+        start = time.perf_counter()
+        User.load_from_file()
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert User.count() == count
+        print(f"{name:>8} {size / 1e6:>8.1f} {size / count:>11.0f} "
+              f"{elapsed:>7.2f}")
+        base.DATA["User"] = {}
+        gc.collect()
+
+
+def main():
+    """
+    Print one row of timings per serializer, or the memory benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-n", "--count", type=int, default=100000,
+                        help="number of users (default 100000)")
+    parser.add_argument("--memory", action="store_true",
+                        help="measure the memory per user instead")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            if args.memory:
+                bench_memory(args.count)
+                return
+            make_users(args.count)
+            objs_json = {obj_id: user.to_json(True)
+                         for obj_id, user in base.DATA["User"].items()}
+            print("{} users".format(args.count))
+            print(f"{'format':>8} {'size MB':>8} {'dump s':>7} "
+                  f"{'load s':>7} {'save s':>7} {'reload s':>9}")
+            for name, serializer in SERIALIZERS.items():
+                file_path = "bench.{}".format(serializer.extension)
+
+                def dump():
+                    with open(file_path, 'wb') as f:
+                        serializer.dump(objs_json, f)
+
+                def load():
+                    with open(file_path, 'rb') as f:
+                        return dict(serializer.load(f))
+
+                dump_time = best(dump)
+                load_time = best(load)
+                size = os.path.getsize(file_path) / 1e6
+                base.SERIALIZER = name
+                save_time = best(User.save_to_file)
+                reload_time = best(User.load_from_file)
+                assert User.count() == args.count
+                print(f"{name:>8} {size:>8.2f} {dump_time:>7.3f} "
+                      f"{load_time:>7.3f} {save_time:>7.3f} "
+                      f"{reload_time:>9.3f}")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+""" Compact store module
+"""
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from itertools import accumulate
+from operator import itemgetter
+from typing import Callable, Dict, Iterator, TypeVar
+
+from models.serializers import EPOCH, TIMESTAMPS
+
+
+# Value of an attribute an object does not have
+MISSING = object()
+
+
+def _key(obj_id: str):
+    """ Return a canonical UUID as its 128-bit int, other ids as is
+    """
+    if type(obj_id) is str and len(obj_id) == 36 and \
+            obj_id[8] == obj_id[13] == obj_id[18] == obj_id[23] == "-":
+        digits = obj_id.replace("-", "")
+        try:
+            key = int(digits, 16)
+        except ValueError:
+            return obj_id
+        if len(digits) == 32 and "%032x" % key == digits:
+            return key
+    return obj_id
+
+
+def _id(key) -> str:
+    """ Inverse of `_key`
+    """
+    if type(key) is not int:
+        return key
+    digits = "%032x" % key
+    return "{}-{}-{}-{}-{}".format(digits[:8], digits[8:12], digits[12:16],
+                                   digits[16:20], digits[20:])
+
+
+class Column():
+    """ Values of one attribute, by row
+
+    Subclasses pack the values they can; any other value (including
+    MISSING) is kept as is in `exceptions`, by row.
+    """
+
+    def __init__(self):
+        """ Initialize an empty column
+        """
+        self.exceptions = {}
+
+    def get(self, row: int):
+        """ Return the value of a row
+        """
+        if row in self.exceptions:
+            return self.exceptions[row]
+        return self.unpack(row)
+
+    def set(self, row: int, value):
+        """ Set the value of a row, `row == len` appending it
+        """
+        packed = self.pack(value)
+        if packed is MISSING:
+            self.exceptions[row] = value
+            packed = self.blank
+        else:
+            self.exceptions.pop(row, None)
+        self.store(row, packed)
+
+    def extend(self, values: list):
+        """ Append values
+        """
+        for value in values:
+            self.set(len(self), value)
+
+    def move(self, src: int, dst: int):
+        """ Copy the value of row `src` over row `dst`
+        """
+        self.set(dst, self.get(src))
+
+    def pop(self):
+        """ Drop the last row
+        """
+        self.exceptions.pop(len(self) - 1, None)
+        self.truncate()
+
+
+class EpochColumn(Column):
+    """ Timestamps as int64 epoch seconds
+    """
+    blank = 0
+
+    def __init__(self):
+        """ Initialize an empty column
+        """
+        super().__init__()
+        self.values = array('q')
+
+    def __len__(self) -> int:
+        """ Number of rows
+        """
+        return len(self.values)
+
+    def pack(self, value):
+        """ Return epoch seconds, or MISSING if not a timestamp
+        """
+        if type(value) is str:
+            try:
+                parsed = datetime.fromisoformat(value)
+            except ValueError:
+                return MISSING
+            if parsed.isoformat() != value:
+                return MISSING
+            value = parsed
+        if type(value) is datetime and value.tzinfo is None:
+            value = (value - EPOCH) // timedelta(seconds=1)
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return value
+        return MISSING
+
+    def extend(self, values: list):
+        """ Append values, in bulk if all are timestamps
+        """
+        packed = list(map(self.pack, values))
+        if any(value is MISSING for value in packed):
+            super().extend(values)
+        else:
+            self.values.extend(packed)
+
+    def unpack(self, row: int) -> int:
+        """ Epoch seconds of a row, decoded by Base on first access
+        """
+        return self.values[row]
+
+    def store(self, row: int, packed: int):
+        """ Write packed epoch seconds
+        """
+        if row == len(self.values):
+            self.values.append(packed)
+        else:
+            self.values[row] = packed
+
+    def truncate(self):
+        """ Drop the last row
+        """
+        self.values.pop()
+
+
+class HexColumn(Column):
+    """ Lowercase hexadecimal strings of one length (digests), as bytes
+    """
+
+    def __init__(self, width: int):
+        """ Initialize an empty column of `width` hex digits
+        """
+        super().__init__()
+        self.width = width // 2
+        self.blank = bytes(self.width)
+        self.values = bytearray()
+
+    def __len__(self) -> int:
+        """ Number of rows
+        """
+        return len(self.values) // self.width
+
+    def pack(self, value) -> bytes:
+        """ Return the bytes of the digest, or MISSING
+        """
+        if type(value) is not str or len(value) != 2 * self.width:
+            return MISSING
+        try:
+            packed = bytes.fromhex(value)
+        except ValueError:
+            return MISSING
+        return packed if packed.hex() == value else MISSING
+
+    def extend(self, values: list):
+        """ Append values, in bulk if all are digests
+        """
+        if set(map(type, values)) == {str} and \
+                set(map(len, values)) == {2 * self.width}:
+            text = "".join(values)
+            try:
+                packed = bytes.fromhex(text)
+            except ValueError:
+                packed = b""
+            if packed.hex() == text:
+                self.values += packed
+                return
+        super().extend(values)
+
+    def unpack(self, row: int) -> str:
+        """ Hex string of a row
+        """
+        start = row * self.width
+        return self.values[start:start + self.width].hex()
+
+    def store(self, row: int, packed: bytes):
+        """ Write packed bytes
+        """
+        start = row * self.width
+        self.values[start:start + self.width] = packed
+
+    def truncate(self):
+        """ Drop the last row
+        """
+        del self.values[-self.width:]
+
+
+class DictColumn(Column):
+    """ Strings (or None) as uint32 codes into a table of distinct
+    values, so that repeated strings are held once
+    """
+    blank = 0
+
+    def __init__(self):
+        """ Initialize an empty column
+        """
+        super().__init__()
+        self.codes = array('I')
+        self.strings = []
+        self.lookup = {}
+
+    def __len__(self) -> int:
+        """ Number of rows
+        """
+        return len(self.codes)
+
+    def pack(self, value) -> int:
+        """ Return the code of a string or None, adding it if new
+        """
+        if value is not None and type(value) is not str:
+            return MISSING
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def unpack(self, row: int) -> str:
+        """ String of a row
+        """
+        return self.strings[self.codes[row]]
+
+    def store(self, row: int, packed: int):
+        """ Write a code
+        """
+        if row == len(self.codes):
+            self.codes.append(packed)
+        else:
+            self.codes[row] = packed
+
+    def truncate(self):
+        """ Drop the last row
+        """
+        self.codes.pop()
+
+    def distinct(self) -> bool:
+        """ Whether most strings are distinct, a plain list being
+        smaller then
+        """
+        return len(self.strings) > 1000 and \
+            len(self.strings) * 2 > len(self.codes)
+
+
+class StrColumn(Column):
+    """ Strings (or None) as UTF-8 in one buffer, by offset and length;
+    replaced strings stay in the buffer until it is mostly garbage
+    """
+    blank = None
+    # Length marking None
+    NONE = 2 ** 32 - 1
+
+    def __init__(self):
+        """ Initialize an empty column
+        """
+        super().__init__()
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.data = bytearray()
+        self.garbage = 0
+
+    def __len__(self) -> int:
+        """ Number of rows
+        """
+        return len(self.lengths)
+
+    def pack(self, value) -> bytes:
+        """ Return the UTF-8 of a string, None for None, else MISSING
+        """
+        if value is None:
+            return None
+        if type(value) is not str:
+            return MISSING
+        return value.encode()
+
+    def extend(self, values: list):
+        """ Append values, in bulk if all are strings or None
+        """
+        if not set(map(type, values)) <= {str, type(None)}:
+            super().extend(values)
+            return
+        encoded = [b"" if value is None else value.encode()
+                   for value in values]
+        lengths = [self.NONE if value is None else len(packed)
+                   for value, packed in zip(values, encoded)]
+        self.offsets.extend(accumulate(map(len, encoded[:-1]),
+                                       initial=len(self.data)))
+        self.lengths.extend(lengths)
+        self.data += b"".join(encoded)
+
+    def unpack(self, row: int) -> str:
+        """ String of a row
+        """
+        length = self.lengths[row]
+        if length == self.NONE:
+            return None
+        offset = self.offsets[row]
+        return self.data[offset:offset + length].decode()
+
+    def store(self, row: int, packed: bytes):
+        """ Append the UTF-8 to the buffer and point the row at it
+        """
+        length = self.NONE if packed is None else len(packed)
+        if row == len(self.lengths):
+            self.offsets.append(len(self.data))
+            self.lengths.append(length)
+        else:
+            self._discard(row)
+            self.offsets[row] = len(self.data)
+            self.lengths[row] = length
+        if packed:
+            self.data += packed
+        if self.garbage > 2 ** 20 and self.garbage * 2 > len(self.data):
+            self._compact()
+
+    def truncate(self):
+        """ Drop the last row
+        """
+        self._discard(len(self.lengths) - 1)
+        self.offsets.pop()
+        self.lengths.pop()
+
+    def _discard(self, row: int):
+        """ Count the UTF-8 of a row as garbage
+        """
+        if self.lengths[row] != self.NONE:
+            self.garbage += self.lengths[row]
+
+    def _compact(self):
+        """ Rewrite the buffer without garbage
+        """
+        data = bytearray()
+        for row, length in enumerate(self.lengths):
+            if length != self.NONE:
+                offset = self.offsets[row]
+                self.offsets[row] = len(data)
+                data += self.data[offset:offset + length]
+        self.data = data
+        self.garbage = 0
+
+
+class ListColumn(Column):
+    """ Any values, as a list
+    """
+    blank = None
+
+    def __init__(self, values: list = None):
+        """ Initialize a column, empty by default
+        """
+        super().__init__()
+        self.values = values if values is not None else []
+
+    def __len__(self) -> int:
+        """ Number of rows
+        """
+        return len(self.values)
+
+    def pack(self, value):
+        """ Keep any value but MISSING
+        """
+        return value
+
+    def extend(self, values: list):
+        """ Append values
+        """
+        if any(value is MISSING for value in values):
+            super().extend(values)
+        else:
+            self.values.extend(values)
+
+    def unpack(self, row: int):
+        """ Value of a row
+        """
+        return self.values[row]
+
+    def store(self, row: int, packed):
+        """ Write a value
+        """
+        if row == len(self.values):
+            self.values.append(packed)
+        else:
+            self.values[row] = packed
+
+    def truncate(self):
+        """ Drop the last row
+        """
+        self.values.pop()
+
+
+class CompactStore(MutableMapping):
+    """ Mapping of id -> object kept as columns instead of objects
+
+    Each attribute is a column, typed on its first value: TIMESTAMPS
+    as int64 epoch seconds, hex digests as bytes, other strings as
+    codes into a table of distinct strings (one UTF-8 buffer once most
+    are distinct), anything else as a list. UUID ids are held as
+    128-bit ints. Objects are built on each access, with epoch second
+    timestamps that Base decodes on first use; none is cached.
+    Timestamps keep whole seconds, as in the snapshot files.
+    """
+
+    def __init__(self, factory: Callable):
+        """ Initialize an empty store
+        """
+        self._factory = factory
+        self._attributes = None
+        self._rows = {}
+        self._keys = []
+        self._columns = {}
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over all ids
+        """
+        return map(_id, list(self._keys))
+
+    def __contains__(self, obj_id: object) -> bool:
+        """ Whether the id is stored
+        """
+        return _key(obj_id) in self._rows
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return the object, built from its row
+        """
+        return self._load(self._rows[_key(obj_id)])
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Store the attributes of an object
+        """
+        self._set(obj_id, vars(obj))
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object, moving the last row in its place
+        """
+        key = _key(obj_id)
+        row = self._rows.pop(key)
+        last = len(self._keys) - 1
+        if row != last:
+            moved = self._keys[last]
+            self._keys[row] = moved
+            self._rows[moved] = row
+            for column in self._columns.values():
+                column.move(last, row)
+        self._keys.pop()
+        for column in self._columns.values():
+            column.pop()
+
+    def holds(self, obj_id: str, obj: TypeVar('Base')) -> bool:
+        """ Objects are never held, see `LazyStore.holds`
+        """
+        return False
+
+    def values(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over all objects
+        """
+        return (self[obj_id] for obj_id in self)
+
+    def items(self) -> Iterator[tuple]:
+        """ Iterate over (id, object) pairs
+        """
+        return ((obj_id, self[obj_id]) for obj_id in self)
+
+    def extend(self, objs_json: Dict[str, dict]):
+        """ Store objects from their attributes, without building them
+        A column at a time into an empty store if all objects have the
+        same attributes
+        """
+        records = list(objs_json.values())
+        if self._keys or not records or \
+                any(obj_json.keys() != records[0].keys()
+                    for obj_json in records):
+            for obj_id, obj_json in objs_json.items():
+                self._set(obj_id, obj_json)
+            return
+        for name in records[0]:
+            if name == "id":
+                continue
+            values = list(map(itemgetter(name), records))
+            column = self._column(name, values[0])
+            if isinstance(column, DictColumn) and \
+                    len(set(values)) * 2 > len(values) > 1000:
+                column = StrColumn()
+            column.extend(values)
+            self._columns[name] = column
+        self._keys = list(map(_key, objs_json))
+        self._rows = dict(zip(self._keys, range(len(self._keys))))
+
+    def _set(self, obj_id: str, attributes: dict):
+        """ Write the attributes of an object in its row, a new row at
+        the end if the id is new
+        """
+        key = _key(obj_id)
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = len(self._keys)
+            self._keys.append(key)
+        for name, value in attributes.items():
+            if name == "id":
+                continue
+            column = self._columns.get(name)
+            if column is None:
+                column = self._columns[name] = self._column(name, value)
+            column.set(row, value)
+            if isinstance(column, DictColumn) and column.distinct():
+                self._columns[name] = StrColumn()
+                for i in range(len(column)):
+                    self._columns[name].set(i, column.get(i))
+        for name, column in self._columns.items():
+            if name not in attributes:
+                column.set(row, MISSING)
+
+    def _column(self, name: str, value) -> Column:
+        """ Return a new column for an attribute, MISSING in all rows
+        """
+        if name in TIMESTAMPS:
+            column = EpochColumn()
+        elif type(value) is str and value and len(value) % 2 == 0 and \
+                HexColumn(len(value)).pack(value) is not MISSING:
+            column = HexColumn(len(value))
+        elif value is None or type(value) is str:
+            column = DictColumn()
+        else:
+            column = ListColumn()
+        for row in range(len(self._keys)):
+            column.set(row, MISSING)
+        return column
+
+    def _load(self, row: int) -> TypeVar('Base'):
+        """ Build the object of a row
+        """
+        obj_json = {"id": _id(self._keys[row])}
+        for name, column in self._columns.items():
+            value = column.get(row)
+            if value is not MISSING:
+                obj_json[name] = value
+        if self._attributes is None:
+            self._attributes = vars(self._factory()).keys()
+        if obj_json.keys() != self._attributes:
+            return self._factory(**obj_json)
+        obj = self._factory.__new__(self._factory)
+        object.__setattr__(obj, '__dict__', obj_json)
+        return obj
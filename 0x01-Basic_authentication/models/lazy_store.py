@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+""" Lazy store module
+"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, TypeVar
+import json
+
+
+class LazyStore(MutableMapping):
+    """ Mapping of id -> object backed by file offsets
+
+    Each id points to the (path, offset, length) of its JSON in a
+    snapshot or journal file, along with the values of its hash-indexed
+    attributes there; the object is only built on first access. At
+    most `max_resident` objects stay in memory, least recently used
+    first out. Objects set but not yet written to disk have no location
+    and are pinned until `set_location` is called.
+    """
+
+    def __init__(self, factory: Callable, max_resident: int):
+        """ Initialize an empty store
+        """
+        self._factory = factory
+        self.max_resident = max_resident
+        self._locations = {}
+        self._values = {}
+        self._resident = OrderedDict()
+        self._pinned = {}
+        self._files = {}
+
+    def __len__(self) -> int:
+        """ Number of objects, resident or not
+        """
+        return len(self._locations)
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over all ids
+        """
+        return iter(self._locations)
+
+    def __contains__(self, obj_id: object) -> bool:
+        """ Whether the id is stored
+        """
+        return obj_id in self._locations
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return the object, loading it if not resident
+        """
+        obj = self._pinned.get(obj_id)
+        if obj is not None:
+            return obj
+        obj = self._resident.get(obj_id)
+        if obj is not None:
+            self._resident.move_to_end(obj_id)
+            return obj
+        obj = self._load(self._locations[obj_id])
+        self._resident[obj_id] = obj
+        self._evict()
+        return obj
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Store an object in memory until its location is known
+        """
+        self._locations[obj_id] = None
+        self._resident.pop(obj_id, None)
+        self._pinned[obj_id] = obj
+        self._evict()
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object
+        """
+        del self._locations[obj_id]
+        self._values.pop(obj_id, None)
+        self._resident.pop(obj_id, None)
+        self._pinned.pop(obj_id, None)
+
+    def holds(self, obj_id: str, obj: TypeVar('Base')) -> bool:
+        """ Whether this very instance is the resident one for the id
+        """
+        return (self._pinned.get(obj_id) or
+                self._resident.get(obj_id)) is obj
+
+    def peek(self, obj_id: str) -> TypeVar('Base'):
+        """ Return the object without adding it to the resident set
+        """
+        obj = self._pinned.get(obj_id) or self._resident.get(obj_id)
+        if obj is None:
+            obj = self._load(self._locations[obj_id])
+        return obj
+
+    def values(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over all objects without churning the resident set
+        """
+        return (self.peek(obj_id) for obj_id in list(self._locations))
+
+    def items(self) -> Iterator[tuple]:
+        """ Iterate over (id, object) pairs, see `values`
+        """
+        return ((obj_id, self.peek(obj_id))
+                for obj_id in list(self._locations))
+
+    def indexed(self) -> Iterator[tuple]:
+        """ Iterate over (id, values of the hash-indexed attributes)
+        pairs, taken from memory or as recorded with the locations
+        """
+        attrs = self._factory._indexes
+        for obj_id in list(self._locations):
+            obj = self._pinned.get(obj_id) or self._resident.get(obj_id)
+            values = self._values.get(obj_id)
+            if obj is None and values is None:
+                obj = self._load(self._locations[obj_id])
+            if obj is not None:
+                values = [getattr(obj, attr, None) for attr in attrs]
+            yield obj_id, values
+
+    def indexed_values(self, obj_id: str) -> list:
+        """ Return the recorded values of the hash-indexed attributes
+        of an object, None if unknown
+        """
+        return self._values.get(obj_id)
+
+    def raw(self, obj_id: str) -> bytes:
+        """ Return the stored JSON of a non-resident object, else None
+        """
+        if obj_id in self._pinned or obj_id in self._resident:
+            return None
+        return self._read(self._locations[obj_id])
+
+    def set_location(self, obj_id: str, path: str, offset: int,
+                     length: int, values: list = None):
+        """ Record where the JSON of an object is on disk, and the
+        values of its hash-indexed attributes in it
+        """
+        self._locations[obj_id] = (path, offset, length)
+        self._values[obj_id] = values
+        self._unpin(obj_id)
+        self._evict()
+
+    def drop(self, obj_id: str):
+        """ Drop the copy of an object in memory, unless pinned, its
+        JSON on disk having been changed by another process
+        """
+        self._resident.pop(obj_id, None)
+
+    def set_locations(self, path: str, offsets: Dict[str, list]):
+        """ Record the locations of many objects of one file, as
+        {id: [offset, length, indexed values]}
+        """
+        for obj_id, (offset, length, values) in offsets.items():
+            self._locations[obj_id] = (path, offset, length)
+            self._values[obj_id] = values
+            self._unpin(obj_id)
+        self._evict()
+
+    def reopen(self):
+        """ Close file handles, after a file was replaced or truncated
+        """
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def _read(self, location: tuple) -> bytes:
+        """ Read the JSON bytes at a location
+        """
+        path, offset, length = location
+        f = self._files.get(path)
+        if f is None:
+            f = self._files[path] = open(path, 'rb')
+        f.seek(offset)
+        return f.read(length)
+
+    def _load(self, location: tuple) -> TypeVar('Base'):
+        """ Build the object stored at a location
+        """
+        return self._factory(**json.loads(self._read(location)))
+
+    def _unpin(self, obj_id: str):
+        """ Make an object written to disk evictable
+        """
+        obj = self._pinned.pop(obj_id, None)
+        if obj is not None:
+            self._resident[obj_id] = obj
+
+    def _evict(self):
+        """ Drop least recently used objects that are on disk
+        """
+        while self._resident and \
+                len(self._resident) + len(self._pinned) > self.max_resident:
+            self._resident.popitem(last=False)
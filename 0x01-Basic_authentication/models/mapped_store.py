@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+""" Mapped store module
+"""
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableMapping
+from itertools import accumulate
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+
+def _attr_entry(value) -> bytes:
+    """ Entry of an indexed attribute: b"s" + UTF-8 of a string, empty
+    for anything else (not in the hash table)
+    """
+    return b"s" + value.encode() if isinstance(value, str) else b""
+
+
+def _text_entry(value) -> bytes:
+    """ Entry of a text attribute: NUL + UTF-8 of the lowercased string
+    """
+    return b"\0" + value.lower().encode() if isinstance(value, str) \
+        else b"\0"
+
+
+class _Snapshot():
+    """ A mapped snapshot file, never changed once written
+    """
+    MAGIC = b"BASEMAP1"
+
+    def __init__(self, file_path: str = None):
+        """ Map the file, or stand for an empty snapshot if None or
+        missing
+        """
+        self.map = b""
+        self.count = 0
+        self.tables = {}
+        self.slots = {}
+        if file_path is None or not os.path.exists(file_path):
+            return
+        with open(file_path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("Not a mapped snapshot: {}".format(file_path))
+        size, = struct.unpack_from("<Q", self.map, len(self.map) - 8)
+        trailer = json.loads(self.map[-8 - size:-8])
+        if trailer["byteorder"] != sys.byteorder:
+            raise ValueError("Mapped snapshot of a {}-endian host: {}"
+                             .format(trailer["byteorder"], file_path))
+        self.count = trailer["count"]
+        view = memoryview(self.map)
+        for name, position in trailer["tables"].items():
+            end = position + 8 * (self.count + 1)
+            self.tables[name] = (view[position:end].cast('Q'), end)
+        for name, (position, size) in trailer["slots"].items():
+            self.slots[name] = view[position:position + 4 * size].cast('I')
+
+    def entry(self, name: str, row: int) -> bytes:
+        """ Entry of a row in a string table
+        """
+        offsets, blob = self.tables[name]
+        return self.map[blob + offsets[row]:blob + offsets[row + 1]]
+
+    def find(self, name: str, entry: bytes) -> Iterator[int]:
+        """ Iterate over the rows whose entry of a hashed table matches
+        """
+        slots = self.slots.get(name)
+        if not slots or not entry:
+            return
+        mask = len(slots) - 1
+        slot = zlib.crc32(entry) & mask
+        while slots[slot]:
+            row = slots[slot] - 1
+            if self.entry(name, row) == entry:
+                yield row
+            slot = (slot + 1) & mask
+
+    def row(self, obj_id: object) -> Optional[int]:
+        """ Row of an id, None if not in the snapshot
+        """
+        if not isinstance(obj_id, str):
+            return None
+        return next(self.find("id", obj_id.encode()), None)
+
+    def text_rows(self, name: str, needle: bytes) -> Iterator[int]:
+        """ Iterate over the rows whose entry of a text table contains
+        the needle
+        """
+        offsets, blob = self.tables[name]
+        end = blob + offsets[self.count]
+        position = self.map.find(needle, blob, end)
+        while position != -1:
+            row = bisect_right(offsets, position - blob) - 1
+            yield row
+            position = self.map.find(needle, blob + offsets[row + 1], end)
+
+
+class MappedStore(MutableMapping):
+    """ Mapping of id -> object served from a read-only memory-mapped
+    snapshot, shared by all the processes mapping the same file
+
+    The snapshot (.db_<class>.map) holds, in native byte order:
+    - string tables, uint64 offsets of the `count + 1` entries then
+      their bytes: the ids, the JSON of the objects, each `_indexes`
+      attribute (see `_attr_entry`) and each `_text_indexes` attribute
+      (see `_text_entry`, a prefix being found as NUL + prefix)
+    - hash tables, uint32 slots of row + 1 (0 if empty) probed
+      linearly from the CRC-32 of the entry: on the ids and on each
+      `_indexes` attribute
+    - a JSON trailer giving their positions, then its uint64 length
+    Lookups by id or indexed attribute only read the mapped pages, and
+    objects are built on each access, none is cached. Objects set or
+    deleted since the snapshot was written form an overlay, private to
+    the process, until `save` writes the next snapshot.
+    The snapshot and the overlay are replaced together by `save`, so
+    that iterations started before go on over the previous ones.
+    """
+
+    def __init__(self, factory: Callable, file_path: str):
+        """ Map the snapshot of the class, if written yet
+        """
+        self._factory = factory
+        self._path = file_path
+        self._indexes = tuple(factory._indexes)
+        self._text_indexes = tuple(factory._text_indexes)
+        self._attributes = None
+        self._open()
+
+    def _open(self):
+        """ Map the snapshot with an empty overlay: objects set, ids
+        deleted, and ids of the overlay not in the snapshot (in
+        insertion order)
+        """
+        self._state = (_Snapshot(self._path), {}, set(), {})
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        snapshot, _, deleted, new = self._state
+        return snapshot.count - len(deleted) + len(new)
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over all ids
+        """
+        return (obj_id for obj_id, _ in self._rows())
+
+    def __contains__(self, obj_id: object) -> bool:
+        """ Whether the id is stored
+        """
+        snapshot, overlay, deleted, _ = self._state
+        if obj_id in overlay:
+            return True
+        return obj_id not in deleted and snapshot.row(obj_id) is not None
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return the object, from the overlay or built from its row
+        """
+        snapshot, overlay, deleted, _ = self._state
+        obj = overlay.get(obj_id)
+        if obj is not None:
+            return obj
+        row = None if obj_id in deleted else snapshot.row(obj_id)
+        if row is None:
+            raise KeyError(obj_id)
+        return self._load(snapshot, row)
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Store an object in the overlay
+        """
+        snapshot, overlay, deleted, new = self._state
+        if obj_id not in overlay and snapshot.row(obj_id) is None:
+            new[obj_id] = None
+        overlay[obj_id] = obj
+        deleted.discard(obj_id)
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object, hiding its row if any
+        """
+        snapshot, overlay, deleted, new = self._state
+        if obj_id not in self:
+            raise KeyError(obj_id)
+        overlay.pop(obj_id, None)
+        new.pop(obj_id, None)
+        if snapshot.row(obj_id) is not None:
+            deleted.add(obj_id)
+
+    def holds(self, obj_id: str, obj: TypeVar('Base')) -> bool:
+        """ The store indexes its objects itself, see `LazyStore.holds`
+        """
+        return False
+
+    def values(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over all objects
+        """
+        return (obj for _, obj in self.items())
+
+    def items(self) -> Iterator[tuple]:
+        """ Iterate over (id, object) pairs
+        """
+        snapshot = self._state[0]
+        return ((obj_id, self._load(snapshot, obj) if type(obj) is int
+                 else obj) for obj_id, obj in self._rows())
+
+    def search(self, attributes: dict) -> Iterable[TypeVar('Base')]:
+        """ Return the objects that may match the attributes, narrowed
+        with the id or an indexed attribute; the caller checks each one
+        """
+        obj_id = attributes.get("id")
+        if isinstance(obj_id, str):
+            obj = self.get(obj_id)
+            return [] if obj is None else [obj]
+        state = self._state
+        for attr, value in attributes.items():
+            name = "attr_{}".format(attr)
+            if name in state[0].slots and isinstance(value, str):
+                return self._candidates(
+                    state, state[0].find(name, _attr_entry(value)))
+        return self.values()
+
+    def text_search(self, query: str, attributes: Iterable[str],
+                    prefix: bool = False) -> Iterable[TypeVar('Base')]:
+        """ Return the objects whose lowercased text attributes may
+        contain (or start with) the lowercase `query`, found by scanning
+        the mapped text tables; the caller checks each one
+        """
+        state = self._state
+        names = ["text_{}".format(attr) for attr in attributes]
+        if not query or "\0" in query or \
+                any(name not in state[0].tables for name in names):
+            return self.values()
+        needle = (b"\0" if prefix else b"") + query.encode()
+        rows = set()
+        for name in names:
+            rows.update(state[0].text_rows(name, needle))
+        return self._candidates(state, sorted(rows))
+
+    def save(self):
+        """ Write the next snapshot, with the overlay folded in, then
+        map it; processes still mapping the previous one keep it
+        """
+        snapshot, overlay, deleted, new = self._state
+        ids = []
+        tables = {"data": []}
+        for attr in self._indexes:
+            tables["attr_{}".format(attr)] = []
+        for attr in self._text_indexes:
+            tables["text_{}".format(attr)] = []
+        for row in range(snapshot.count):
+            obj_id = snapshot.entry("id", row)
+            key = obj_id.decode()
+            if key in deleted:
+                continue
+            ids.append(obj_id)
+            if key in overlay:
+                self._append(tables, overlay[key])
+                continue
+            obj_json = None
+            for name, entries in tables.items():
+                if name in snapshot.tables:
+                    entries.append(snapshot.entry(name, row))
+                    continue
+                # Attribute indexed since the snapshot was written
+                if obj_json is None:
+                    obj_json = json.loads(snapshot.entry("data", row))
+                value = obj_json.get(name.split("_", 1)[1])
+                entries.append(_attr_entry(value) if name[0] == "a"
+                               else _text_entry(value))
+        for obj_id in new:
+            ids.append(obj_id.encode())
+            self._append(tables, overlay[obj_id])
+        tables = dict(id=ids, **tables)
+
+        trailer = {"count": len(ids), "byteorder": sys.byteorder,
+                   "tables": {}, "slots": {}}
+        tmp_path = "{}.tmp".format(self._path)
+        with open(tmp_path, 'wb') as f:
+            f.write(_Snapshot.MAGIC)
+            for name, entries in tables.items():
+                trailer["tables"][name] = f.tell()
+                array('Q', accumulate(map(len, entries), initial=0)).tofile(f)
+                f.writelines(entries)
+                f.write(bytes(-f.tell() % 8))
+            for name in ["id"] + ["attr_{}".format(attr)
+                                  for attr in self._indexes]:
+                slots = self._hash_table(tables[name])
+                trailer["slots"][name] = [f.tell(), len(slots)]
+                slots.tofile(f)
+            encoded = json.dumps(trailer).encode()
+            f.write(encoded + struct.pack("<Q", len(encoded)))
+        os.replace(tmp_path, self._path)
+        self._open()
+
+    def _append(self, tables: dict, obj: TypeVar('Base')):
+        """ Append the entries of an object to the tables but the ids
+        """
+        tables["data"].append(json.dumps(obj.to_json(True)).encode())
+        for attr in self._indexes:
+            tables["attr_{}".format(attr)].append(
+                _attr_entry(getattr(obj, attr, None)))
+        for attr in self._text_indexes:
+            tables["text_{}".format(attr)].append(
+                _text_entry(getattr(obj, attr, None)))
+
+    def _hash_table(self, entries: List[bytes]) -> array:
+        """ Build the hash table of the non-empty entries
+        """
+        size = 8
+        while size < 2 * len(entries):
+            size *= 2
+        mask = size - 1
+        slots = array('I', bytes(4 * size))
+        for row, entry in enumerate(entries, 1):
+            if entry:
+                slot = zlib.crc32(entry) & mask
+                while slots[slot]:
+                    slot = (slot + 1) & mask
+                slots[slot] = row
+        return slots
+
+    def _rows(self) -> Iterator[tuple]:
+        """ Iterate over (id, row or overlay object) pairs of the state
+        when called
+        """
+        snapshot, overlay, deleted, new = self._state
+        for row in range(snapshot.count):
+            obj_id = snapshot.entry("id", row).decode()
+            if obj_id not in deleted:
+                yield obj_id, overlay.get(obj_id, row)
+        for obj_id in list(new):
+            obj = overlay.get(obj_id)
+            if obj is not None:
+                yield obj_id, obj
+
+    def _candidates(self, state: tuple,
+                    rows: Iterable[int]) -> List[TypeVar('Base')]:
+        """ Objects of the rows still current, then all the objects of
+        the overlay
+        """
+        snapshot, overlay, deleted, _ = state
+        objs = []
+        for row in rows:
+            obj_id = snapshot.entry("id", row).decode()
+            if obj_id not in deleted and obj_id not in overlay:
+                objs.append(self._load(snapshot, row))
+        return objs + list(overlay.values())
+
+    def _load(self, snapshot: _Snapshot, row: int) -> TypeVar('Base'):
+        """ Build the object of a row, its attributes becoming its
+        __dict__ as is if they are the ones the constructor sets
+        """
+        obj_json = json.loads(snapshot.entry("data", row))
+        if self._attributes is None:
+            self._attributes = vars(self._factory()).keys()
+        if obj_json.keys() != self._attributes:
+            return self._factory(**obj_json)
+        obj = self._factory.__new__(self._factory)
+        object.__setattr__(obj, '__dict__', obj_json)
+        return obj
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Regression checks of the Base store.
+
+Run `python3 -m models.regression` from the project root to run every
+check, or `python3 -m models.regression lazy_indexes` for some of them.
+Each check runs in its own interpreter and temporary directory, with
+the BASE_* settings of the mode it covers; the multi-process ones start
+writer processes of this module next to it. Exits non-zero if a check
+fails.
+"""
+
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta, timezone
+from typing import Callable, Dict, List, Tuple
+
+import models.base as base
+from models.user import User
+
+# Checks by name: (function, BASE_* settings)
+CHECKS: Dict[str, Tuple[Callable[[], None], dict]] = {}
+
+
+def check(name: str, **settings: str):
+    """
+    Register a check run with the given BASE_* settings.
+    """
+    def register(func: Callable[[], None]) -> Callable[[], None]:
+        CHECKS[name] = (func, settings)
+        return func
+    return register
+
+
+def run_writer(*args: str):
+    """
+    Run a writer action of this module in another process, with the
+    settings and directory of the current check.
+    """
+    subprocess.run([sys.executable, "-m", "models.regression", "--write",
+                    *args], check=True, timeout=60)
+
+
+def make_users(count: int) -> List[User]:
+    """
+    Load the users, then save `count` new ones.
+    """
+    User.load_from_file()
+    users = []
+    for i in range(count):
+        user = User(email="user{:03d}@example.com".format(i))
+        user.save()
+        users.append(user)
+    return users
+
+
+def write(action: str, *args: str):
+    """
+    Writer process: add, rename or remove one user, or compact.
+    """
+    User.load_from_file()
+    if action == "add":
+        User(email=args[0]).save()
+    elif action == "rename":
+        user = User.search({"email": args[0]})[0]
+        user.email = args[1]
+        user.save()
+    elif action == "remove":
+        User.search({"email": args[0]})[0].remove()
+    elif action == "compact":
+        User.compact()
+
+
+@check("cursors")
+def check_cursors():
+    """
+    Cursor pagination visits every user once; forged cursors raise
+    ValueError.
+    """
+    users = make_users(23)
+    for order_by in ("email", "created_at", "id"):
+        seen, after = [], None
+        while True:
+            page = list(User.query(order_by=order_by, limit=5, after=after))
+            if not page:
+                break
+            seen += [user.id for user in page]
+            after = User.cursor(page[-1], order_by)
+        assert sorted(seen) == sorted(user.id for user in users), order_by
+        assert len(seen) == len(set(seen)), order_by
+
+    def forged(rank, value) -> str:
+        text = json.dumps([rank, value, "id"])
+        return base64.urlsafe_b64encode(text.encode()).decode()
+
+    for cursor in ("not a cursor", forged(1, "text"), forged(2, 3),
+                   forged(1, True), forged(7, None), forged("2", "a"),
+                   forged(3, "2000-01-01T00:00:00+00:00"),
+                   forged(3, "yesterday")):
+        try:
+            list(User.query(order_by="email", after=cursor))
+        except ValueError:
+            continue
+        raise AssertionError("accepted cursor {}".format(cursor))
+    try:
+        list(User.query(after=User.cursor(users[0])))
+        raise AssertionError("accepted a cursor without an order")
+    except ValueError:
+        pass
+
+
+@check("ranges")
+def check_ranges():
+    """
+    Timestamp ranges take naive, aware and ISO string bounds alike;
+    counts agree with the queries; bad bounds raise ValueError.
+    """
+    users = make_users(10)
+    now = users[-1].created_at + timedelta(seconds=1)
+    aware = now.replace(tzinfo=timezone.utc).astimezone(
+        timezone(timedelta(hours=5)))
+    for high in (now, aware, now.isoformat(), aware.isoformat()):
+        ranges = {"created_at": (None, high)}
+        assert len(list(User.query(ranges=ranges, limit=20))) == 10, high
+        assert User.count(ranges=ranges) == 10, high
+        ranges = {"created_at": (high, None)}
+        assert list(User.query(ranges=ranges)) == [], high
+        assert User.count(ranges=ranges) == 0, high
+    ranges = {"email": ("user003@example.com", "user007@example.com")}
+    assert User.count(ranges=ranges) == 4
+    assert [user.email for user in User.query(ranges=ranges)] == \
+        ["user{:03d}@example.com".format(i) for i in range(3, 7)]
+    try:
+        User.count(ranges={"created_at": ("yesterday", None)})
+        raise AssertionError("accepted a bad bound")
+    except ValueError:
+        pass
+
+
+@check("lazy_indexes", BASE_LAZY="1", BASE_MAX_RESIDENT="2")
+def check_lazy_indexes():
+    """
+    The indexes of a lazy store stay exact while its objects are
+    evicted and read back from disk, then once reloaded.
+    """
+    users = make_users(5)
+    list(User.query(order_by="updated_at"))
+    User.text_search("user")
+    for user in users[1:]:
+        User.get(user.id)
+    first = User.get(users[0].id)
+    first.save()
+    first.email = "first@example.com"
+    first.save()
+    users[3].remove()
+    for _ in range(2):
+        assert len(list(User.query(order_by="updated_at"))) == 4
+        assert User.count(ranges={"updated_at": (None, None)}) == 4
+        assert User.count(ranges={"created_at": (None, None)}) == 4
+        assert len(User.search({"email": "first@example.com"})) == 1
+        assert User.search({"email": "user000@example.com"}) == []
+        assert User.search({"email": "user003@example.com"}) == []
+        assert len(User.text_search("first@")) == 1
+        User.load_from_file()
+
+    # The email index is rebuilt from the offset index, the search
+    # reading only the object found
+    store = base.DATA["User"]
+    assert isinstance(store, base.LazyStore)
+    reads = []
+    load = store._load
+    store._load = lambda location: reads.append(location) or load(location)
+    assert len(User.search({"email": "first@example.com"})) == 1
+    assert len(reads) == 1, "read {} objects".format(len(reads))
+
+
+def check_shared():
+    """
+    Writes of other processes are seen here, indexes included, whether
+    replayed from the journal or reloaded from a new snapshot; the
+    writes held here are kept over them.
+    """
+    make_users(20)
+    assert len(User.search({"email": "user001@example.com"})) == 1
+    list(User.query(order_by="updated_at"))
+    User.text_search("user")
+
+    run_writer("add", "added@example.com")
+    assert len(User.search({"email": "added@example.com"})) == 1
+    assert User.count() == 21
+    run_writer("rename", "user002@example.com", "renamed@example.com")
+    assert User.search({"email": "user002@example.com"}) == []
+    assert len(User.search({"email": "renamed@example.com"})) == 1
+    assert len(User.text_search("renamed")) == 1
+    run_writer("remove", "user003@example.com")
+    assert User.count() == 20
+    assert User.count(ranges={"updated_at": (None, None)}) == 20
+    assert len(list(User.query(order_by="updated_at"))) == 20
+
+    with User.batch():
+        User(email="held@example.com").save()
+        run_writer("compact")
+        run_writer("add", "after@example.com")
+        assert len(User.search({"email": "held@example.com"})) == 1
+        assert len(User.search({"email": "after@example.com"})) == 1
+    run_writer("add", "last@example.com")
+    assert User.count() == 23
+    assert len(User.search({"email": "held@example.com"})) == 1
+
+
+check("shared", BASE_SHARED="1")(check_shared)
+check("shared_journal", BASE_SHARED="1", BASE_JOURNAL="1")(check_shared)
+check("shared_lazy", BASE_SHARED="1", BASE_JOURNAL="1", BASE_LAZY="1",
+      BASE_MAX_RESIDENT="3")(check_shared)
+check("shared_compact", BASE_SHARED="1", BASE_JOURNAL="1",
+      BASE_COMPACT="1")(check_shared)
+check("mapped", BASE_MAPPED="1", BASE_JOURNAL="1")(check_shared)
+
+
+@check("sqlite", BASE_STORAGE="sqlite", BASE_DURABILITY="exit")
+def check_sqlite():
+    """
+    Writes held by a deferred durability mode or a batch do not lock
+    other processes out of the SQLite database.
+    """
+    make_users(5)
+    with User.batch():
+        User(email="held@example.com").save()
+        start = time.monotonic()
+        run_writer("add", "other@example.com")
+        assert time.monotonic() - start < 5, "writer waited for the lock"
+    run_writer("rename", "held@example.com", "renamed@example.com")
+    assert User.count() == 7
+    assert len(User.search({"email": "renamed@example.com"})) == 1
+    assert len(User.search({"email": "other@example.com"})) == 1
+
+
+def main():
+    """
+    Run the checks named in the arguments (all if none), each in a new
+    interpreter, or a check or writer action in this one
+    """
+    args = sys.argv[1:]
+    if args and args[0] == "--write":
+        write(*args[1:])
+        return
+    if args and args[0] == "--run":
+        CHECKS[args[1]][0]()
+        return
+
+    root = os.getcwd()
+    env = {key: value for key, value in os.environ.items()
+           if not key.startswith("BASE_")}
+    env["PYTHONPATH"] = root
+    if os.environ.get("PYTHONPATH"):
+        env["PYTHONPATH"] += os.pathsep + os.environ["PYTHONPATH"]
+    failed = []
+    for name in args or CHECKS:
+        func, settings = CHECKS[name]
+        with tempfile.TemporaryDirectory() as tmp:
+            result = subprocess.run(
+                [sys.executable, "-m", "models.regression", "--run", name],
+                cwd=tmp, env=dict(env, **settings), timeout=300)
+        print("{:<16} {}".format(name, "ok" if result.returncode == 0
+                                 else "FAILED"))
+        if result.returncode != 0:
+            failed.append(name)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+""" SQLite store module
+"""
+from collections.abc import MutableMapping
+from typing import Callable, Iterable, Iterator, List, TypeVar
+import json
+import sqlite3
+import threading
+
+
+def _quote(name: str) -> str:
+    """ Quote an SQL identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _sql_value(value):
+    """ Return the value if SQLite can store and compare it, else None
+    """
+    if value is None or type(value) in (str, float):
+        return value
+    if type(value) in (int, bool) and -2 ** 63 <= value < 2 ** 63:
+        return int(value)
+    return None
+
+
+class SQLiteStore(MutableMapping):
+    """ Mapping of id -> object backed by an SQLite table
+
+    The table of a class holds the JSON of each object under its id
+    (primary key), one indexed column per `_indexes` attribute and one
+    lowercased column per `_text_indexes` attribute, so get, count and
+    search run as SQL lookups without holding every object in memory.
+    Objects are built on each access, none is cached. The database is
+    in WAL mode and each write commits on its own, so that the write
+    lock is only held for one statement and readers never wait; the
+    write is durable at once if `durable`, else once `sync` is called.
+    """
+    # Rows fetched per query when iterating over the whole table
+    PAGE = 1000
+
+    def __init__(self, factory: Callable, db_path: str,
+                 durable: bool = True):
+        """ Open the database, creating the table of the class if needed
+        The transaction stays open: `created` tells whether the table is
+        new, so that it can be filled before the first `commit`
+        """
+        self._factory = factory
+        self._table = _quote(factory.__name__)
+        self._indexes = tuple(factory._indexes)
+        self._text_indexes = tuple(factory._text_indexes)
+        self._columns = ["attr_{}".format(attr) for attr in self._indexes] + \
+            ["text_{}".format(attr) for attr in self._text_indexes]
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, isolation_level=None,
+                                   check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = {}".format(
+                "FULL" if durable else "NORMAL"))
+            self._begin()
+            existing = [row[1] for row in self._db.execute(
+                "PRAGMA table_info({})".format(self._table))]
+            self.created = not existing
+            if self.created:
+                self._db.execute("CREATE TABLE {} (id TEXT PRIMARY KEY, "
+                                 "data TEXT NOT NULL)".format(self._table))
+            added = [column for column in self._columns
+                     if column not in existing]
+            for column in added:
+                self._db.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                    self._table, _quote(column)))
+            for attr in self._indexes:
+                self._db.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})"
+                                 .format(_quote("{}_{}".format(
+                                     factory.__name__, attr)), self._table,
+                                     _quote("attr_{}".format(attr))))
+            if added and not self.created:
+                # Attributes indexed since the table was filled
+                for obj_id, obj in list(self.items()):
+                    self[obj_id] = obj
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM {}".format(
+                self._table)).fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over all ids
+        """
+        return (row[0] for row in self._rows("id"))
+
+    def __contains__(self, obj_id: object) -> bool:
+        """ Whether the id is stored
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM {} WHERE id = ?".format(self._table),
+                (obj_id,)).fetchone() is not None
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return the object, built from its row
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM {} WHERE id = ?".format(self._table),
+                (obj_id,)).fetchone()
+        if row is None:
+            raise KeyError(obj_id)
+        return self._load(row[0])
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Insert or update the row of an object
+        """
+        values = [_sql_value(getattr(obj, attr, None))
+                  for attr in self._indexes]
+        for attr in self._text_indexes:
+            value = getattr(obj, attr, None)
+            values.append(value.lower() if isinstance(value, str) else None)
+        columns = ", ".join(map(_quote, ["id", "data"] + self._columns))
+        updates = ", ".join("{0} = excluded.{0}".format(_quote(column))
+                            for column in ["data"] + self._columns)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT (id) DO UPDATE "
+                "SET {}".format(self._table, columns,
+                                ", ".join("?" * (len(values) + 2)), updates),
+                [obj_id, json.dumps(obj.to_json(True))] + values)
+
+    def __delitem__(self, obj_id: str):
+        """ Delete the row of an object
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM {} WHERE id = ?".format(self._table), (obj_id,))
+        if cursor.rowcount == 0:
+            raise KeyError(obj_id)
+
+    def holds(self, obj_id: str, obj: TypeVar('Base')) -> bool:
+        """ Objects are never held in memory, see `LazyStore.holds`
+        """
+        return False
+
+    def values(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over all objects, one page of rows at a time
+        """
+        return (self._load(row[0]) for row in self._rows("data"))
+
+    def items(self) -> Iterator[tuple]:
+        """ Iterate over (id, object) pairs, see `values`
+        """
+        return ((obj_id, self._load(data))
+                for obj_id, data in self._rows("id, data"))
+
+    def search(self, attributes: dict) -> Iterable[TypeVar('Base')]:
+        """ Return the objects that may match the attributes, narrowed
+        with the id and indexed columns; the caller checks each one
+        """
+        conditions = []
+        params = []
+        for attr, value in attributes.items():
+            if attr == "id":
+                column = "id"
+            elif attr in self._indexes:
+                column = "attr_{}".format(attr)
+            else:
+                continue
+            if value is None:
+                conditions.append("{} IS NULL".format(_quote(column)))
+            elif _sql_value(value) is not None:
+                conditions.append("{} = ?".format(_quote(column)))
+                params.append(_sql_value(value))
+        if not conditions:
+            return self.values()
+        return self._select(conditions, params)
+
+    def text_search(self, query: str, attributes: Iterable[str],
+                    prefix: bool = False) -> Iterable[TypeVar('Base')]:
+        """ Return the objects whose lowercased text attributes may
+        contain (or start with) the lowercase `query`; the caller
+        checks each one
+        """
+        if not query or any(attr not in self._text_indexes
+                            for attr in attributes):
+            return self.values()
+        conditions = []
+        params = []
+        for attr in attributes:
+            column = _quote("text_{}".format(attr))
+            if prefix:
+                conditions.append("substr({}, 1, ?) = ?".format(column))
+                params += [len(query), query]
+            else:
+                conditions.append("instr({}, ?) > 0".format(column))
+                params.append(query)
+        return self._select([" OR ".join(conditions)], params)
+
+    def commit(self):
+        """ Commit the transaction opened with the store
+        """
+        with self._lock:
+            if self._db.in_transaction:
+                self._db.commit()
+
+    def sync(self):
+        """ Make the writes committed so far durable, checkpointing
+        the write-ahead log into the database
+        """
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(FULL)").fetchall()
+
+    def _begin(self):
+        """ Open a transaction unless one is already open
+        """
+        if not self._db.in_transaction:
+            self._db.execute("BEGIN")
+
+    def _load(self, data: str) -> TypeVar('Base'):
+        """ Build an object from its JSON
+        """
+        return self._factory(**json.loads(data))
+
+    def _select(self, conditions: List[str],
+                params: list) -> List[TypeVar('Base')]:
+        """ Return the objects of the rows matching all conditions
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM {} WHERE {}".format(
+                    self._table, " AND ".join(
+                        "({})".format(condition)
+                        for condition in conditions)),
+                params).fetchall()
+        return [self._load(data) for data, in rows]
+
+    def _rows(self, columns: str) -> Iterator[tuple]:
+        """ Iterate over the given columns of all rows, in pages keyed
+        on rowid so that writes in between are safe
+        """
+        rowid = 0
+        while True:
+            with self._lock:
+                page = self._db.execute(
+                    "SELECT rowid, {} FROM {} WHERE rowid > ? ORDER BY rowid "
+                    "LIMIT ?".format(columns, self._table),
+                    (rowid, self.PAGE)).fetchall()
+            for row in page:
+                yield row[1:]
+            if len(page) < self.PAGE:
+                return
+            rowid = page[-1][0]
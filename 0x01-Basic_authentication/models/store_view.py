@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+""" Store view module
+"""
+from collections.abc import ItemsView, KeysView, Mapping, ValuesView
+from typing import Iterator, TypeVar
+
+
+class StoreView(Mapping):
+    """ Read-only mapping of id -> object of a class at one version
+
+    Wraps an objects dict that is no longer written to: while a view is
+    alive, Base copies the dict before the next write instead (copy on
+    write), so the view stays consistent without being copied itself.
+    Its iterators keep it alive, hence its dict unwritten, until they
+    are exhausted or dropped. The objects are the stored instances.
+    """
+    __slots__ = ('_objs', 'version', '__weakref__')
+
+    def __init__(self, objs: dict, version: int):
+        """ Initialize a view of a dict no longer written to
+        """
+        self._objs = objs
+        self.version = version
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        return len(self._objs)
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over all ids
+        """
+        yield from self._objs
+
+    def __contains__(self, obj_id: object) -> bool:
+        """ Whether the id is in the view
+        """
+        return obj_id in self._objs
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return the object of an id
+        """
+        return self._objs[obj_id]
+
+    def get(self, obj_id: str, default=None) -> TypeVar('Base'):
+        """ Return the object of an id, or `default`
+        """
+        return self._objs.get(obj_id, default)
+
+    def keys(self) -> KeysView:
+        """ Set-like view of the ids
+        """
+        return KeysView(self)
+
+    def values(self) -> ValuesView:
+        """ View of the objects
+        """
+        return _Values(self)
+
+    def items(self) -> ItemsView:
+        """ Set-like view of the (id, object) pairs
+        """
+        return _Items(self)
+
+
+class _Values(ValuesView):
+    """ Objects of a StoreView, iterated at dict speed
+    """
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects
+        """
+        yield from self._mapping._objs.values()
+
+
+class _Items(ItemsView):
+    """ (id, object) pairs of a StoreView, iterated at dict speed
+    """
+
+    def __iter__(self) -> Iterator[tuple]:
+        """ Iterate over the (id, object) pairs
+        """
+        yield from self._mapping._objs.items()
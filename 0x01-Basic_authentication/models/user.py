@@ -8,6 +8,9 @@ from models.base import Base
 class User(Base):
     """ User class
     """
+    _indexes = ('email',)
+    _text_indexes = ('email', 'first_name', 'last_name')
+    _sorted_indexes = ('id', 'created_at', 'updated_at', 'email')
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
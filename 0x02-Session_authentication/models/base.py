@@ -1,20 +1,195 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from itertools import islice, repeat
+from typing import TypeVar, List, Iterable, Iterator
+from os import getenv, path
+import atexit
+import base64
+import heapq
+import fcntl
 import json
+import os
+import signal
+import threading
+import time
 import uuid
+import weakref
+from models.compact_store import CompactStore
+from models.lazy_store import LazyStore
+from models.mapped_store import MappedStore
+from models.sqlite_store import SQLiteStore
+from models.store_view import StoreView
+from models.serializers import EPOCH, SERIALIZERS, TIMESTAMPS
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+# Writes to DATA of each class, the version of its snapshot views
+VERSIONS = {}
+# Live snapshot view of the current DATA dict of each class, if any:
+# {class name: weakref to StoreView}
+VIEWS = {}
+
+# Append each save/remove to a journal instead of rewriting the file
+JOURNAL = getenv("BASE_JOURNAL", "0") == "1"
+# Journal records tolerated before folding them into the snapshot, as
+# many as objects if more; exactly that many with a mapped store, where
+# each process holds the objects of the journal records in memory
+JOURNAL_COMPACT_MIN = int(getenv("BASE_JOURNAL_COMPACT_MIN", "1000"))
+JOURNAL_LENGTH = {}
+# Byte offset in the journal of each class up to which it was applied
+JOURNAL_OFFSETS = {}
+# Secondary indexes: {class name: {attribute: {value: {id: None}}}}
+INDEXES = {}
+# Trigram indexes, built on first use by text_search:
+# {class name: {trigram: {id: None}}}
+TRIGRAMS = {}
+# Sorted indexes, built on first use by query:
+# {class name: {attribute: [(order key, id)]}}
+SORTED = {}
+# Objects read per lock hold by query, doubling from the first chunk
+# size up to the last one
+QUERY_CHUNKS = (16, 256)
+# Load objects from the file on first access instead of at startup
+LAZY = getenv("BASE_LAZY", "0") == "1"
+# Objects kept in memory per class in lazy mode
+MAX_RESIDENT = int(getenv("BASE_MAX_RESIDENT", "10000"))
+# Nesting depth of Base.batch() in each thread (`depth` attribute), and
+# the writes held back by batches and the DURABILITY mode:
+# {class: [(op, id, object)]}
+BATCH = threading.local()
+PENDING = {}
+# When saves/removes reach the file: "sync" (each write), "interval"
+# (every DURABILITY_INTERVAL_MS), "writes" (every DURABILITY_WRITES
+# writes) or "exit" (at exit or on SIGTERM/SIGINT only)
+DURABILITY = getenv("BASE_DURABILITY", "sync")
+DURABILITY_INTERVAL_MS = int(getenv("BASE_DURABILITY_INTERVAL_MS", "1000"))
+DURABILITY_WRITES = int(getenv("BASE_DURABILITY_WRITES", "100"))
+PENDING_WRITES = 0
+# Guards DATA, the indexes and the pending writes for threaded servers
+PENDING_LOCK = threading.RLock()
+FLUSHER = None
+# Snapshot format, a key of models.serializers.SERIALIZERS; lazy mode
+# always uses the JSON snapshot, its objects being read by offset
+SERIALIZER = getenv("BASE_SERIALIZER", "json")
+# Storage backend: "file" (DATA in memory, saved to .db_<class>.*
+# files) or "sqlite" (one table per class in SQLITE_PATH, nothing kept
+# in memory; LAZY, JOURNAL and SERIALIZER do not apply)
+STORAGE = getenv("BASE_STORAGE", "file")
+SQLITE_PATH = getenv("BASE_SQLITE_PATH", ".db.sqlite3")
+# Keep the objects loaded from file as compact columns (CompactStore)
+# instead of objects, built on access; not with LAZY
+COMPACT = getenv("BASE_COMPACT", "0") == "1"
+# Serve the objects from the read-only memory-mapped .db_<class>.map
+# snapshot, shared by all processes, only the objects saved or removed
+# since it was written being held per process; best with JOURNAL, each
+# save_to_file writing a new snapshot. Not with LAZY nor COMPACT.
+# Implies SHARED, each process writing its next snapshot from the
+# latest one
+MAPPED = getenv("BASE_MAPPED", "0") == "1"
+# Share the .db_<class> files between processes: writes hold an
+# exclusive lock on .db_<class>.lock and bump the generation counter it
+# holds, and a class whose generation changed is reloaded before it is
+# accessed (only the new journal records being replayed unless a new
+# snapshot was written); the SQLite storage is shared as is, each write
+# committing on its own
+SHARED = getenv("BASE_SHARED", "0") == "1" or MAPPED
+# Generation of the files of each class as last loaded or written
+GENERATIONS = {}
+# Generation of the snapshot of each class as last loaded or written
+SNAPSHOTS = {}
+# Lock file of each class: {class name: {"fd", "pid", "depth",
+# "exclusive"}}
+LOCK_FILES = {}
+
+
+def trigrams(text: str) -> set:
+    """ Return the set of lowercase trigrams of a string
+    """
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def order_key(value) -> tuple:
+    """ Return the sort key of an attribute value: None first, then
+    numbers, strings, datetimes and anything else by its repr
+    """
+    if value is None:
+        return (0,)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value)
+    return (4, repr(value))
+
+
+def _encode_cursor(key: tuple, obj_id: str) -> str:
+    """ Return the opaque cursor of a sorted index entry
+    """
+    value = key[1] if len(key) > 1 else None
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    text = json.dumps([key[0], value, obj_id])
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+# Type of the value of each order_key rank in a cursor, datetimes
+# being ISO strings
+CURSOR_TYPES = (type(None), (int, float), str, str, str)
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """ Return the sorted index entry of a cursor, raise ValueError if
+    it is not one, its value not being of the type of its rank
+    included (it would not compare with the index entries)
+    """
+    try:
+        rank, value, obj_id = json.loads(base64.urlsafe_b64decode(
+            cursor.encode()))
+        valid = type(rank) is int and 0 <= rank < len(CURSOR_TYPES) and \
+            isinstance(value, CURSOR_TYPES[rank]) and \
+            not isinstance(value, bool) and isinstance(obj_id, str)
+        if valid and rank == 3:
+            value = datetime.fromisoformat(value)
+            # Naive like the stored timestamps
+            valid = value.tzinfo is None
+    except (TypeError, ValueError):
+        valid = False
+    if not valid:
+        raise ValueError("Invalid cursor: {}".format(cursor))
+    return ((rank,) if rank == 0 else (rank, value), obj_id)
+
+
+def _writes(method):
+    """ Run a classmethod writing the files of the class under its
+    exclusive lock, then publish a new generation of them
+    """
+    @wraps(method)
+    def wrapper(cls, *args, **kwargs):
+        with cls._locked(True):
+            result = method(cls, *args, **kwargs)
+            cls._bump()
+        return result
+    return wrapper
 
 
 class Base():
     """ Base class
     """
+    # Attributes kept in a value -> ids hash index, used by search
+    _indexes = ()
+    # Text attributes kept in the trigram index, used by text_search
+    _text_indexes = ()
+    # Attributes query orders and ranges with a sorted index
+    _sorted_indexes = ('id', 'created_at', 'updated_at')
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
@@ -25,16 +200,220 @@ class Base():
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = kwargs.get('created_at')
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = kwargs.get('updated_at')
         else:
             self.updated_at = datetime.utcnow()
 
+    def _timestamp(self, name: str) -> datetime:
+        """ Return a timestamp attribute, decoding its string or epoch
+        seconds form once
+        """
+        value = self.__dict__[name]
+        if type(value) is str:
+            value = datetime.strptime(value, TIMESTAMP_FORMAT)
+            self.__dict__[name] = value
+        elif type(value) is int:
+            value = EPOCH + timedelta(seconds=value)
+            self.__dict__[name] = value
+        return value
+
+    @property
+    def created_at(self) -> datetime:
+        """ Creation time, decoded on first access
+        """
+        return self._timestamp('created_at')
+
+    @created_at.setter
+    def created_at(self, value):
+        """ Set the creation time (datetime, TIMESTAMP_FORMAT string or
+        epoch seconds)
+        """
+        self._set_timestamp('created_at', value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update time, decoded on first access
+        """
+        return self._timestamp('updated_at')
+
+    @updated_at.setter
+    def updated_at(self, value):
+        """ Set the update time (datetime, TIMESTAMP_FORMAT string or
+        epoch seconds)
+        """
+        self._set_timestamp('updated_at', value)
+
+    def _set_timestamp(self, name: str, value):
+        """ Set a timestamp attribute, datetimes to the second: the
+        precision it is stored at, so that an object indexes the same
+        in memory as once reloaded
+        """
+        if type(value) is datetime:
+            value = value.replace(microsecond=0)
+        self.__dict__[name] = value
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, moving the object in its index if stored,
+        under the lock guarding the indexes
+        """
+        if name not in self._indexes and name not in self._text_indexes \
+                and name not in self._sorted_indexes:
+            super().__setattr__(name, value)
+            return
+        with PENDING_LOCK:
+            if not self._is_stored():
+                super().__setattr__(name, value)
+                return
+            self._index_discard(name)
+            super().__setattr__(name, value)
+            self._index_add(name)
+
+    def _is_stored(self) -> bool:
+        """ Whether this very instance is the one held in DATA
+        """
+        s_class = self.__class__.__name__
+        obj_id = self.__dict__.get('id')
+        objs = DATA.get(s_class, {})
+        if isinstance(objs, (LazyStore, SQLiteStore, CompactStore,
+                             MappedStore)):
+            return objs.holds(obj_id, self)
+        return objs.get(obj_id) is self
+
+    @classmethod
+    def _class_indexes(cls) -> dict:
+        """ Return the secondary indexes of the class, building them
+        on first use
+        """
+        s_class = cls.__name__
+        if INDEXES.get(s_class) is None:
+            cls.rebuild_indexes()
+        return INDEXES[s_class]
+
+    def _trigrams(self) -> set:
+        """ Return the trigrams of all text-indexed attributes
+        """
+        grams = set()
+        for attr in self._text_indexes:
+            value = getattr(self, attr, None)
+            if isinstance(value, str):
+                grams |= trigrams(value)
+        return grams
+
+    def _index_add(self, *attrs: str):
+        """ Add the object to its indexes (all if no attribute given)
+        """
+        indexes = self._class_indexes()
+        for attr in attrs or self._indexes:
+            if attr not in indexes:
+                continue
+            try:
+                indexes[attr].setdefault(getattr(self, attr, None),
+                                         {})[self.id] = None
+            except TypeError:
+                pass
+        postings = TRIGRAMS.get(self.__class__.__name__)
+        if postings is not None and (not attrs or any(
+                attr in self._text_indexes for attr in attrs)):
+            for gram in self._trigrams():
+                postings.setdefault(gram, {})[self.id] = None
+        sorted_indexes = SORTED.get(self.__class__.__name__, {})
+        for attr in attrs or self._sorted_indexes:
+            if attr in sorted_indexes:
+                insort(sorted_indexes[attr],
+                       (order_key(getattr(self, attr, None)), self.id))
+
+    def _index_discard(self, *attrs: str):
+        """ Remove the object from its indexes (all if none given)
+        """
+        indexes = self._class_indexes()
+        for attr in attrs or self._indexes:
+            if attr not in indexes:
+                continue
+            try:
+                value = getattr(self, attr, None)
+                ids = indexes[attr].get(value)
+            except TypeError:
+                continue
+            if ids is not None:
+                ids.pop(self.id, None)
+                if not ids:
+                    del indexes[attr][value]
+        postings = TRIGRAMS.get(self.__class__.__name__)
+        if postings is not None and (not attrs or any(
+                attr in self._text_indexes for attr in attrs)):
+            for gram in self._trigrams():
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.pop(self.id, None)
+                    if not ids:
+                        del postings[gram]
+        sorted_indexes = SORTED.get(self.__class__.__name__, {})
+        for attr in attrs or self._sorted_indexes:
+            index = sorted_indexes.get(attr)
+            if index is None:
+                continue
+            entry = (order_key(getattr(self, attr, None)), self.id)
+            i = bisect_left(index, entry)
+            if i < len(index) and index[i] == entry:
+                del index[i]
+
+    @classmethod
+    def rebuild_indexes(cls):
+        """ Rebuild the secondary indexes from DATA, the trigram and
+        sorted indexes being rebuilt on their next use
+        """
+        s_class = cls.__name__
+        INDEXES[s_class] = {attr: {} for attr in cls._indexes}
+        TRIGRAMS[s_class] = None
+        SORTED[s_class] = {}
+        objs = DATA.get(s_class, {})
+        if not isinstance(objs, LazyStore):
+            for obj in objs.values():
+                obj._index_add()
+            return
+        # From the values recorded with the locations, not reading the
+        # objects from disk
+        indexes = INDEXES[s_class]
+        for obj_id, values in objs.indexed():
+            for attr, value in zip(cls._indexes, values):
+                try:
+                    indexes[attr].setdefault(value, {})[obj_id] = None
+                except TypeError:
+                    pass
+
+    @classmethod
+    def _class_trigrams(cls) -> dict:
+        """ Return the trigram index of the class, building it on first
+        use
+        """
+        s_class = cls.__name__
+        cls._class_indexes()
+        if TRIGRAMS.get(s_class) is None:
+            postings = {}
+            for obj in DATA[s_class].values():
+                for gram in obj._trigrams():
+                    postings.setdefault(gram, {})[obj.id] = None
+            TRIGRAMS[s_class] = postings
+        return TRIGRAMS[s_class]
+
+    @classmethod
+    def _sorted_index(cls, attr: str) -> list:
+        """ Return the sorted index of an attribute, building it on
+        first use
+        """
+        s_class = cls.__name__
+        cls._class_indexes()
+        indexes = SORTED.setdefault(s_class, {})
+        if attr not in indexes:
+            indexes[attr] = sorted(
+                (order_key(getattr(obj, attr, None)), obj.id)
+                for obj in DATA[s_class].values())
+        return indexes[attr]
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -51,6 +430,8 @@ class Base():
         for key, value in self.__dict__.items():
             if not for_serialization and key[0] == '_':
                 continue
+            if type(value) is int and key in TIMESTAMPS:
+                value = self._timestamp(key)
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
             else:
@@ -59,71 +440,699 @@ class Base():
 
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal
+        In lazy mode only the offset index is loaded
+        Indexes are rebuilt on first use
+        """
+        GENERATIONS.pop(cls.__name__, None)
+        with cls._locked():
+            cls._load()
+
+    @classmethod
+    def _load(cls):
+        """ Load the objects of the class, see `load_from_file`
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        INDEXES[s_class] = None
+        # Views of the objects replaced keep them
+        VIEWS.pop(s_class, None)
+        VERSIONS[s_class] = VERSIONS.get(s_class, 0) + 1
+        if STORAGE == "sqlite":
+            cls._open_sqlite()
+            return
+        if MAPPED:
+            cls._open_mapped()
+        elif LAZY:
+            cls._convert_to_json()
+            DATA[s_class] = LazyStore(cls, MAX_RESIDENT)
+            if path.exists(file_path):
+                cls._load_offsets()
+        else:
+            cls._load_snapshot()
+        cls.replay_journal()
+        if SHARED:
+            GENERATIONS[s_class] = cls._generation()
+            SNAPSHOTS[s_class] = cls._snapshot_generation()
+
+    @classmethod
+    def _locked(cls, exclusive: bool = False):
+        """ Context holding the in-process lock and, in SHARED mode, the
+        lock file of the class: exclusive to write, shared to reload
+        the objects if another process changed them. Nests
+        """
+        if not SHARED or STORAGE == "sqlite":
+            return PENDING_LOCK
+        if not exclusive and not cls._lock_file()["depth"] and \
+                GENERATIONS.get(cls.__name__) == cls._generation():
+            # Reading objects up to date needs no file lock
+            return PENDING_LOCK
+        return cls._file_locked(exclusive)
+
+    @classmethod
+    @contextmanager
+    def _file_locked(cls, exclusive: bool):
+        """ Context holding the lock file of the class, see `_locked`
+        """
+        with PENDING_LOCK:
+            lock = cls._lock_file()
+            acquire = not lock["depth"] or (
+                exclusive and not lock["exclusive"])
+            if acquire:
+                fcntl.flock(lock["fd"], fcntl.LOCK_EX if exclusive
+                            else fcntl.LOCK_SH)
+                lock["exclusive"] = lock["exclusive"] or exclusive
+            lock["depth"] += 1
+            try:
+                if acquire:
+                    cls._refresh()
+                yield
+            finally:
+                lock["depth"] -= 1
+                if not lock["depth"]:
+                    lock["exclusive"] = False
+                    fcntl.flock(lock["fd"], fcntl.LOCK_UN)
+
+    @classmethod
+    def _lock_file(cls) -> dict:
+        """ Return the lock file of the class, opened once per process
+        (a forked worker must not share the lock of its parent)
+        """
+        s_class = cls.__name__
+        lock = LOCK_FILES.get(s_class)
+        if lock is None or lock["pid"] != os.getpid():
+            fd = os.open(".db_{}.lock".format(s_class),
+                         os.O_RDWR | os.O_CREAT, 0o644)
+            lock = {"fd": fd, "pid": os.getpid(), "depth": 0,
+                    "exclusive": False}
+            LOCK_FILES[s_class] = lock
+        return lock
+
+    @classmethod
+    def _generation(cls) -> int:
+        """ Generation counter of the files of the class
+        """
+        fd = cls._lock_file()["fd"]
+        return int.from_bytes(os.pread(fd, 8, 0), "little")
+
+    @classmethod
+    def _snapshot_generation(cls) -> int:
+        """ Generation counter of the snapshot of the class, bumped by
+        each save_to_file
+        """
+        fd = cls._lock_file()["fd"]
+        return int.from_bytes(os.pread(fd, 8, 8), "little")
+
+    @classmethod
+    def _bump_snapshot(cls):
+        """ Publish a new generation of the snapshot of the class, once
+        written under its exclusive lock: other processes then reload
+        it instead of replaying the journal
+        """
+        if not SHARED or STORAGE == "sqlite":
+            return
+        snapshot = cls._snapshot_generation() + 1
+        os.pwrite(cls._lock_file()["fd"], snapshot.to_bytes(8, "little"), 8)
+        SNAPSHOTS[cls.__name__] = snapshot
+
+    @classmethod
+    def _bump(cls):
+        """ Publish a new generation of the files of the class, once
+        written under its exclusive lock
+        """
+        if not SHARED or STORAGE == "sqlite":
             return
+        generation = cls._generation() + 1
+        os.pwrite(cls._lock_file()["fd"], generation.to_bytes(8, "little"),
+                  0)
+        GENERATIONS[cls.__name__] = generation
+
+    @classmethod
+    def _refresh(cls):
+        """ Catch up with the writes of other processes to the files of
+        the class since they were loaded or written here: replay the
+        journal records they appended, or reload the objects if they
+        wrote a new snapshot. Then apply the writes still pending here
+        over them
+        """
+        s_class = cls.__name__
+        generation = cls._generation()
+        if s_class not in GENERATIONS or GENERATIONS[s_class] == generation:
+            return
+        update = SNAPSHOTS.get(s_class) == cls._snapshot_generation()
+        if update:
+            cls._replay_from(JOURNAL_OFFSETS.get(s_class, 0), True)
+            GENERATIONS[s_class] = generation
+        else:
+            # Set back by _load, not refreshing again if it writes
+            del GENERATIONS[s_class]
+            cls._load()
+        objs = DATA[s_class]
+        indexed = update and cls._keeps_indexes(objs)
+        for op, obj_id, obj in PENDING.get(cls, ()):
+            if indexed and obj_id in objs:
+                objs[obj_id]._index_discard()
+            if op == "save":
+                objs[obj_id] = obj
+                if indexed:
+                    obj._index_add()
+            elif obj_id in objs:
+                del objs[obj_id]
+
+    @classmethod
+    def _keeps_indexes(cls, objs) -> bool:
+        """ Whether the secondary indexes of the class are built and
+        must follow the changes to its store
+        """
+        return INDEXES.get(cls.__name__) is not None and \
+            not isinstance(objs, (SQLiteStore, MappedStore))
+
+    @classmethod
+    def _convert_to_json(cls):
+        """ Rewrite the snapshot of the class as JSON, the format lazy
+        mode reads, if it was last saved in another format or mapped
+        """
+        s_class = cls.__name__
+        if path.exists(".db_{}.json".format(s_class)):
+            return
+        cls._load_snapshot()
+        if DATA[s_class]:
+            cls._save_with(SERIALIZERS["json"])
+
+    @classmethod
+    def _load_snapshot(cls):
+        """ Load all objects of the snapshot into memory
+        """
+        s_class = cls.__name__
+        DATA[s_class] = CompactStore(cls) if COMPACT else {}
+        for name in (SERIALIZER, *SERIALIZERS):
+            # Falls back to the snapshot of another format until the
+            # first save, which removes it
+            serializer = SERIALIZERS[name]
+            file_path = ".db_{}.{}".format(s_class, serializer.extension)
+            if path.exists(file_path):
+                with open(file_path, 'rb') as f:
+                    objs_json = dict(serializer.load(f))
+                if COMPACT:
+                    DATA[s_class].extend(objs_json)
+                else:
+                    DATA[s_class] = cls._restore(objs_json)
+                break
+        else:
+            map_path = ".db_{}.map".format(s_class)
+            if path.exists(map_path):
+                # Last saved in mapped mode
+                objs = dict(MappedStore(cls, map_path).items())
+                if COMPACT:
+                    DATA[s_class].extend({obj_id: vars(obj)
+                                          for obj_id, obj in objs.items()})
+                else:
+                    DATA[s_class] = objs
+
+    @classmethod
+    def _open_sqlite(cls):
+        """ Use the SQLite table of the class as store, filling it from
+        the snapshot and journal files when it is created
+        """
+        s_class = cls.__name__
+        store = SQLiteStore(cls, SQLITE_PATH, DURABILITY == "sync")
+        if store.created:
+            cls._load_snapshot()
+            cls.replay_journal()
+            store.update(DATA[s_class])
+        store.commit()
+        DATA[s_class] = store
+
+    @classmethod
+    def _open_mapped(cls):
+        """ Use the mapped snapshot of the class as store, writing it
+        from the other snapshot files first if missing
+        """
+        s_class = cls.__name__
+        map_path = ".db_{}.map".format(s_class)
+        if path.exists(map_path):
+            DATA[s_class] = MappedStore(cls, map_path)
+            return
+        cls._load_snapshot()
+        objs = DATA[s_class]
+        DATA[s_class] = MappedStore(cls, map_path)
+        DATA[s_class].update(objs)
+        cls.save_to_file()
+
+    @classmethod
+    def _restore(cls, objs_json: dict) -> dict:
+        """ Build the objects of {id: attributes}
+        If every record holds exactly the attributes the constructor
+        sets, the records become the objects' __dict__ as is, in bulk,
+        instead of running the constructor per object
+        """
+        attributes = vars(cls()).keys()
+        if not all(map(attributes.__eq__, map(dict.keys, objs_json.values()))):
+            return {obj_id: cls(**obj_json)
+                    for obj_id, obj_json in objs_json.items()}
+        objs = list(map(cls.__new__, repeat(cls, len(objs_json))))
+        deque(map(object.__setattr__, objs, repeat('__dict__'),
+                  objs_json.values()), maxlen=0)
+        return dict(zip(objs_json, objs))
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _load_offsets(cls):
+        """ Point the lazy store at the objects of the snapshot
+        Uses the .idx offset index if it matches the snapshot, else
+        scans the snapshot and rewrites the index. The index also holds
+        the values of the hash-indexed attributes of each object
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        idx_path = ".db_{}.idx".format(s_class)
+        stat = os.stat(file_path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if path.exists(idx_path):
+            with open(idx_path, 'r') as f:
+                idx = json.load(f)
+            if idx.get("snapshot") == signature and \
+                    idx.get("indexes") == list(cls._indexes):
+                DATA[s_class].set_locations(file_path, idx["offsets"])
+                return
+
+        offsets = {}
+        decoder = json.JSONDecoder()
+        with open(file_path, 'rb') as f:
+            if f.readline() != b"{\n":
+                # Snapshot from before the one-object-per-line layout
+                f.seek(0)
+                for obj_id, obj_json in json.load(f).items():
+                    DATA[s_class][obj_id] = cls(**obj_json)
+                cls.save_to_file()
+                return
+            position = f.tell()
+            for line in f:
+                if line.startswith(b'"'):
+                    text = line.decode()
+                    obj_id, end = decoder.raw_decode(text)
+                    value = line[end + 2:].rstrip(b"\n")
+                    if value.endswith(b","):
+                        value = value[:-1]
+                    offsets[obj_id] = [
+                        position + end + 2, len(value),
+                        cls._indexed_values(json.loads(value))]
+                position += len(line)
+        DATA[s_class].set_locations(file_path, offsets)
+        cls._write_offsets(offsets)
+
+    @classmethod
+    def _write_offsets(cls, offsets: dict):
+        """ Write the offset index of the current snapshot
+        """
+        s_class = cls.__name__
+        stat = os.stat(".db_{}.json".format(s_class))
+        idx_path = ".db_{}.idx".format(s_class)
+        # Per process: readers of a shared snapshot may all rewrite it
+        tmp_path = "{}.{}.tmp".format(idx_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({"snapshot": [stat.st_size, stat.st_mtime_ns],
+                       "indexes": list(cls._indexes),
+                       "offsets": offsets}, f)
+        os.replace(tmp_path, idx_path)
+
+    @classmethod
+    def _indexed_values(cls, obj_json: dict) -> list:
+        """ Return the values of the hash-indexed attributes in the
+        JSON of an object
+        """
+        return [obj_json.get(attr) for attr in cls._indexes]
 
     @classmethod
+    @_writes
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to file in the SERIALIZER format; JSON is
+        written one object per line, objects of a lazy store not in
+        memory being copied as stored. A mapped store writes its next
+        snapshot instead
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        objs = DATA[s_class]
+        cls._bump_snapshot()
+        if isinstance(objs, MappedStore):
+            objs.save()
+            cls._remove_other_snapshots("map")
+            return
+        lazy = isinstance(objs, LazyStore)
+        offsets = {}
+        if not lazy and SERIALIZER != "json":
+            cls._save_with(SERIALIZERS[SERIALIZER])
+            return
+
+        tmp_path = "{}.tmp".format(file_path)
+        with open(tmp_path, 'wb') as f:
+            f.write(b"{\n")
+            separator = b""
+            for obj_id in list(objs):
+                obj_json = objs.raw(obj_id) if lazy else None
+                if obj_json is None:
+                    attributes = objs[obj_id].to_json(True)
+                    values = cls._indexed_values(attributes)
+                    obj_json = json.dumps(attributes).encode()
+                else:
+                    values = objs.indexed_values(obj_id)
+                f.write(separator + json.dumps(obj_id).encode() + b": ")
+                offsets[obj_id] = [f.tell(), len(obj_json), values]
+                f.write(obj_json)
+                separator = b",\n"
+            f.write(b"\n}\n")
+        os.replace(tmp_path, file_path)
+        cls._remove_other_snapshots("json")
+
+        if lazy:
+            objs.reopen()
+            objs.set_locations(file_path, offsets)
+            cls._write_offsets(offsets)
+
+    @classmethod
+    def _save_with(cls, serializer):
+        """ Save all objects to file in the format of a serializer
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.{}".format(s_class, serializer.extension)
+        tmp_path = "{}.tmp".format(file_path)
+        with open(tmp_path, 'wb') as f:
+            serializer.dump({obj_id: vars(obj)
+                             for obj_id, obj in DATA[s_class].items()}, f)
+        os.replace(tmp_path, file_path)
+        cls._remove_other_snapshots(serializer.extension)
+
+    @classmethod
+    def _remove_other_snapshots(cls, extension: str):
+        """ Remove the snapshots of the class in the formats other than
+        the one just written, older than it, the mapped one included
+        """
+        for other in [serializer.extension
+                      for serializer in SERIALIZERS.values()] + ["map"]:
+            file_path = ".db_{}.{}".format(cls.__name__, other)
+            if other != extension and path.exists(file_path):
+                os.remove(file_path)
+
+    @classmethod
+    def replay_journal(cls):
+        """ Apply the journal records over the loaded objects
+        A torn last record (crash during append) is ignored
+        """
+        JOURNAL_LENGTH[cls.__name__] = 0
+        cls._replay_from(0)
+
+    @classmethod
+    def _replay_from(cls, position: int, update: bool = False):
+        """ Apply the journal records from a byte offset, see
+        `replay_journal`; with `update`, over objects in use, as a new
+        version whose indexes follow
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.journal".format(s_class)
+        JOURNAL_OFFSETS[s_class] = position
+        if not path.exists(file_path):
+            return
+
+        objs = cls._writable() if update else DATA[s_class]
+        indexed = update and cls._keeps_indexes(objs)
+        lazy = isinstance(objs, LazyStore)
+        with open(file_path, 'rb') as f:
+            f.seek(position)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if indexed and record["id"] in objs:
+                    objs[record["id"]]._index_discard()
+                if record["op"] != "save":
+                    if record["id"] in objs:
+                        del objs[record["id"]]
+                elif lazy:
+                    start = line.index(b'"obj": ') + 7
+                    length = len(line.rstrip(b"\n")) - 1 - start
+                    if update:
+                        objs.drop(record["id"])
+                    objs.set_location(
+                        record["id"], file_path, position + start, length,
+                        cls._indexed_values(record["obj"]))
+                else:
+                    objs[record["id"]] = cls(**record["obj"])
+                if indexed and record["op"] == "save":
+                    objs[record["id"]]._index_add()
+                JOURNAL_LENGTH[s_class] += 1
+                position += len(line)
+        JOURNAL_OFFSETS[s_class] = position
+        if position < path.getsize(file_path):
+            # Drop the torn record so later appends stay readable
+            with open(file_path, 'r+b') as f:
+                f.truncate(position)
+
+    @classmethod
+    def append_journal(cls, op: str, obj_id: str, obj_json: dict = None):
+        """ Append one save/remove record to the journal
+        """
+        cls.append_journal_many([(op, obj_id, obj_json)])
+
+    @classmethod
+    @_writes
+    def append_journal_many(cls, records: List[tuple]):
+        """ Append (op, id, obj_json) records to the journal in one write
+        Compacts once the journal outgrows the snapshot, or holds
+        JOURNAL_COMPACT_MIN records with a mapped store
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.journal".format(s_class)
+        lines = []
+        locations = []
+        size = 0
+        for op, obj_id, obj_json in records:
+            head = json.dumps({"op": op, "id": obj_id})
+            body = ""
+            if obj_json is not None:
+                head = head[:-1] + ', "obj": '
+                body = json.dumps(obj_json)
+                locations.append((obj_id, size + len(head), len(body),
+                                  cls._indexed_values(obj_json)))
+            line = "{}{}{}\n".format(head, body, "}" if body else "")
+            lines.append(line)
+            size += len(line)
+        with open(file_path, 'ab') as f:
+            start = f.tell()
+            f.write("".join(lines).encode())
+        # Up to date with the journal, refreshed under the lock
+        JOURNAL_OFFSETS[s_class] = start + size
+        if isinstance(DATA[s_class], LazyStore):
+            for obj_id, offset, length, values in locations:
+                if obj_id in DATA[s_class]:
+                    DATA[s_class].set_location(obj_id, file_path,
+                                               start + offset, length,
+                                               values)
+        JOURNAL_LENGTH[s_class] = JOURNAL_LENGTH.get(s_class, 0) + \
+            len(records)
+        limit = JOURNAL_COMPACT_MIN
+        if not isinstance(DATA[s_class], MappedStore):
+            limit = max(limit, len(DATA[s_class]))
+        if JOURNAL_LENGTH[s_class] > limit:
+            cls.compact()
+
+    @classmethod
+    @_writes
+    def compact(cls):
+        """ Fold the journal into a new snapshot and truncate it
+        """
+        s_class = cls.__name__
+        cls.save_to_file()
+        open(".db_{}.journal".format(s_class), 'w').close()
+        JOURNAL_LENGTH[s_class] = 0
+        JOURNAL_OFFSETS[s_class] = 0
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _persist(cls, op: str, obj_id: str, obj: TypeVar('Base') = None):
+        """ Write one save/remove, or hold it back inside a batch or
+        until the DURABILITY mode flushes it
+        """
+        global PENDING_WRITES
+        with PENDING_LOCK:
+            sqlite = isinstance(DATA[cls.__name__], SQLiteStore)
+            batched = getattr(BATCH, "depth", 0)
+            if batched or DURABILITY != "sync":
+                # The SQLite store already committed the write, only
+                # syncing it is left
+                PENDING.setdefault(cls, []).append(
+                    (op, obj_id, None if sqlite else obj))
+                if batched:
+                    return
+                PENDING_WRITES += 1
+                start_flusher()
+                if DURABILITY == "writes" and \
+                        PENDING_WRITES >= DURABILITY_WRITES:
+                    cls.flush_pending()
+            elif sqlite:
+                # Committed and synced by the store
+                pass
+            elif JOURNAL:
+                cls.append_journal(op, obj_id, obj and obj.to_json(True))
+            else:
+                cls.save_to_file()
+
+    @classmethod
+    def flush_pending(cls):
+        """ Write the saves/removes held back by a batch or the
+        DURABILITY mode, one write per class
+        """
+        global PENDING_WRITES
+        with PENDING_LOCK:
+            PENDING_WRITES = 0
+            while PENDING:
+                klass = next(iter(PENDING))
+                with klass._locked(True):
+                    # Popped once the objects are reloaded with them
+                    records = PENDING.pop(klass)
+                    objs = DATA[klass.__name__]
+                    if isinstance(objs, SQLiteStore):
+                        objs.sync()
+                    elif JOURNAL:
+                        klass.append_journal_many(
+                            [(op, obj_id, obj and obj.to_json(True))
+                             for op, obj_id, obj in records])
+                    else:
+                        klass.save_to_file()
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """ Context in which the save/remove of the current thread only
+        update DATA; the writes are flushed once on exit (also on
+        error, so the file matches DATA). Batches nest, the outermost
+        one flushes; other threads keep writing as usual
+        """
+        BATCH.depth = getattr(BATCH, "depth", 0) + 1
+        try:
+            yield
+        finally:
+            BATCH.depth -= 1
+            if BATCH.depth == 0:
+                cls.flush_pending()
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save several objects with a single file write
+        """
+        with cls.batch():
+            for obj in objs:
+                obj.save()
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with self.__class__._locked(True):
+            self.updated_at = datetime.utcnow()
+            objs = self.__class__._writable()
+            # The SQLite and mapped stores index their objects
+            indexed = not isinstance(objs, (SQLiteStore, MappedStore))
+            previous = objs.get(self.id) if indexed else None
+            if previous is not None and previous is not self:
+                previous._index_discard()
+            objs[self.id] = self
+            if indexed and previous is not self:
+                if isinstance(objs, CompactStore):
+                    # Indexed as stored, timestamps to the second
+                    objs[self.id]._index_add()
+                else:
+                    self._index_add()
+            self.__class__._persist("save", self.id, self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with self.__class__._locked(True):
+            objs = DATA[self.__class__.__name__]
+            if self.id not in objs:
+                return
+            objs = self.__class__._writable()
+            if not isinstance(objs, (SQLiteStore, MappedStore)):
+                objs[self.id]._index_discard()
+            del objs[self.id]
+            self.__class__._persist("remove", self.id)
 
     @classmethod
-    def count(cls) -> int:
-        """ Count all objects
+    def count(cls, attributes: dict = {}, ranges: dict = {}) -> int:
+        """ Count all objects, or the ones matching a query (see
+        `query`); a range alone on a sorted index is counted by
+        bisection
         """
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        if not attributes and len(ranges) < 2:
+            with cls._locked():
+                if not ranges:
+                    return len(DATA[s_class].keys())
+                attr, (low, high) = next(iter(ranges.items()))
+                if cls._has_sorted_index(attr):
+                    index = cls._sorted_index(attr)
+                    start, end = 0, len(index)
+                    if low is not None:
+                        start = bisect_left(
+                            index, (order_key(cls._bound(attr, low)),))
+                    if high is not None:
+                        end = bisect_left(
+                            index, (order_key(cls._bound(attr, high)),))
+                    return max(0, end - start)
+        return sum(1 for _ in cls.query(attributes, ranges))
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
-        """ Return all objects
+        """ Return all objects, as the values of a snapshot view
+        """
+        return cls.snapshot().values()
+
+    @classmethod
+    def snapshot(cls) -> StoreView:
+        """ Return a read-only view of the objects as of now, iterated
+        without the lock. Taken in O(1) from the in-memory store, the
+        next write copying the objects dict instead (see `_writable`);
+        the objects of the other stores are copied into it
+        """
+        s_class = cls.__name__
+        with cls._locked():
+            objs = DATA[s_class]
+            version = VERSIONS.get(s_class, 0)
+            if type(objs) is not dict:
+                return StoreView(dict(objs.items()), version)
+            view = VIEWS[s_class]() if s_class in VIEWS else None
+            if view is None:
+                view = StoreView(objs, version)
+                VIEWS[s_class] = weakref.ref(view)
+            return view
+
+    @classmethod
+    def _writable(cls):
+        """ Return the store of the class to write to, under the lock,
+        as a new version: the in-memory store is copied first if a
+        snapshot view of it is still alive, the view keeping it as is
         """
-        return cls.search()
+        s_class = cls.__name__
+        VERSIONS[s_class] = VERSIONS.get(s_class, 0) + 1
+        view = VIEWS.pop(s_class, None)
+        if view is not None and view() is not None:
+            DATA[s_class] = DATA[s_class].copy()
+        return DATA[s_class]
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        with cls._locked():
+            return DATA[s_class].get(id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+        Uses a secondary index (an SQL one with the SQLite store, a
+        mapped one with the mapped store) when one of the attributes
+        has one
         """
         s_class = cls.__name__
         def _search(obj):
@@ -133,5 +1142,284 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        with cls._locked():
+            objs = DATA[s_class]
+            if isinstance(objs, (SQLiteStore, MappedStore)):
+                return list(filter(_search, objs.search(attributes)))
+            candidates = objs.values()
+            indexes = cls._class_indexes()
+            for k, v in attributes.items():
+                if k not in indexes:
+                    continue
+                try:
+                    ids = indexes[k].get(v, {})
+                except TypeError:
+                    continue
+                candidates = [objs[obj_id] for obj_id in ids]
+                break
+            return list(filter(_search, candidates))
+
+    @classmethod
+    def query(cls, attributes: dict = {}, ranges: dict = {},
+              order_by: str = None, descending: bool = False,
+              offset: int = 0, limit: int = None,
+              after: str = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate lazily over the objects matching all `attributes`
+        and `ranges` ({attribute: (low, high)}, low included, high
+        excluded, None for no bound; TIMESTAMPS bounds may be ISO
+        strings)
+        Objects come ordered by `order_by` then id if given (else by
+        the first ranged attribute, else in store order), from the
+        `after` cursor of that order if given (see `cursor`), skipping
+        `offset` of them, `limit` at most
+        Orders and ranges on `_sorted_indexes` read a sorted index a
+        chunk at a time; any other order sorts all matching objects
+        """
+        s_class = cls.__name__
+        bounds = {attr: tuple(None if bound is None else
+                              order_key(cls._bound(attr, bound))
+                              for bound in pair)
+                  for attr, pair in ranges.items()}
+        if order_by is None:
+            order_by = next(iter(bounds), None)
+        cursor = None
+        if after is not None:
+            if order_by is None:
+                raise ValueError("A cursor needs an order")
+            cursor = _decode_cursor(after)
+
+        def _match(obj):
+            for k, v in attributes.items():
+                if getattr(obj, k, None) != v:
+                    return False
+            for attr, (low, high) in bounds.items():
+                key = order_key(getattr(obj, attr, None))
+                if (low is not None and key < low) or \
+                        (high is not None and key >= high):
+                    return False
+            return True
+
+        if order_by is None:
+            matches = filter(_match, cls._candidates(attributes))
+        elif cls._has_sorted_index(order_by):
+            matches = filter(_match, cls._scan(
+                order_by, descending, bounds.get(order_by, (None, None)),
+                cursor))
+        else:
+            entries = (
+                ((order_key(getattr(obj, order_by, None)), obj.id), obj)
+                for obj in filter(_match, cls._candidates(attributes)))
+            if cursor is not None:
+                entries = (item for item in entries
+                           if (item[0] < cursor if descending
+                               else item[0] > cursor))
+            if limit is None:
+                entries = sorted(entries, reverse=descending)
+            else:
+                # Only the first offset + limit are sorted
+                entries = (heapq.nlargest if descending else heapq.nsmallest)(
+                    offset + limit, entries)
+            matches = (obj for _, obj in entries)
+        return islice(matches, offset,
+                      None if limit is None else offset + limit)
+
+    @classmethod
+    def cursor(cls, obj: TypeVar('Base'), order_by: str = "id") -> str:
+        """ Return the cursor from which a query ordered by `order_by`
+        resumes after the object
+        """
+        return _encode_cursor(order_key(getattr(obj, order_by, None)),
+                              obj.id)
+
+    @classmethod
+    def _bound(cls, attr: str, bound):
+        """ Return a range bound, TIMESTAMPS strings as datetimes and
+        timezone-aware ones as naive UTC, like the stored timestamps
+        """
+        if attr in TIMESTAMPS and isinstance(bound, str):
+            bound = datetime.fromisoformat(bound)
+        if attr in TIMESTAMPS and isinstance(bound, datetime) and \
+                bound.tzinfo is not None:
+            bound = bound.astimezone(timezone.utc).replace(tzinfo=None)
+        return bound
+
+    @classmethod
+    def _has_sorted_index(cls, attr: str) -> bool:
+        """ Whether query reads the attribute from a sorted index, the
+        SQLite and mapped stores having none
+        """
+        return attr in cls._sorted_indexes and not isinstance(
+            DATA.get(cls.__name__), (SQLiteStore, MappedStore))
+
+    @classmethod
+    def _candidates(cls, attributes: dict) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects that may match the attributes in
+        store order, narrowed with a secondary index when possible, a
+        chunk at a time, else from a snapshot view of the in-memory store
+        """
+        s_class = cls.__name__
+        with cls._locked():
+            objs = DATA[s_class]
+            if isinstance(objs, (SQLiteStore, MappedStore)):
+                return iter(objs.search(attributes))
+            ids = None
+            indexes = cls._class_indexes()
+            for k, v in attributes.items():
+                if k not in indexes:
+                    continue
+                try:
+                    ids = list(indexes[k].get(v, {}))
+                except TypeError:
+                    continue
+                break
+            if ids is None:
+                if type(objs) is dict:
+                    return iter(cls.snapshot().values())
+                ids = list(objs)
+        return cls._fetch(ids)
+
+    @classmethod
+    def _fetch(cls, ids: List[str]) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects of ids still stored
+        """
+        start, size = 0, QUERY_CHUNKS[0]
+        while start < len(ids):
+            with cls._locked():
+                objs = DATA[cls.__name__]
+                found = [objs.get(obj_id)
+                         for obj_id in ids[start:start + size]]
+            yield from (obj for obj in found if obj is not None)
+            start, size = start + size, min(2 * size, QUERY_CHUNKS[1])
+
+    @classmethod
+    def _scan(cls, attr: str, descending: bool, bounds: tuple,
+              cursor: tuple = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects in the order of the sorted index of
+        an attribute, from the cursor entry or the bound (order keys)
+        the scan starts from, to the other bound
+        Each chunk is found again by bisection from the last entry read,
+        so that writes in between are safe
+        """
+        s_class = cls.__name__
+        low, high = bounds
+        last = cursor
+        if last is None:
+            # (key,) sorts before the entries (key, id) of the same key
+            last = (((5,) if high is None else high),) if descending \
+                else (((),) if low is None else (low,))
+        size = QUERY_CHUNKS[0]
+        while True:
+            with cls._locked():
+                index = cls._sorted_index(attr)
+                if descending:
+                    end = bisect_left(index, last)
+                    chunk = index[max(0, end - size):end][::-1]
+                else:
+                    start = bisect_right(index, last)
+                    chunk = index[start:start + size]
+                objs = DATA[s_class]
+                found = [(entry, objs.get(entry[1])) for entry in chunk]
+            for entry, obj in found:
+                if (low is not None and entry[0] < low) if descending \
+                        else (high is not None and entry[0] >= high):
+                    return
+                if obj is not None:
+                    yield obj
+            if len(chunk) < size:
+                return
+            last, size = chunk[-1], min(2 * size, QUERY_CHUNKS[1])
+
+    @classmethod
+    def text_search(cls, query: str, attributes: Iterable[str] = None,
+                    prefix: bool = False) -> List[TypeVar('Base')]:
+        """ Search objects whose text attributes contain `query`
+        (case-insensitive), or start with it if `prefix` is True
+        Queries of 3+ characters are narrowed with the trigram index,
+        or in SQL with the SQLite store; the mapped store scans its
+        mapped text columns
+        """
+        s_class = cls.__name__
+        query = query.lower()
+        attributes = tuple(attributes or cls._text_indexes)
+        grams = trigrams(query)
+
+        def _match(obj):
+            for attr in attributes:
+                value = getattr(obj, attr, None)
+                if not isinstance(value, str):
+                    continue
+                value = value.lower()
+                if value.startswith(query) if prefix else query in value:
+                    return True
+            return False
+
+        with cls._locked():
+            objs = DATA[s_class]
+            candidates = objs.values()
+            if isinstance(objs, (SQLiteStore, MappedStore)):
+                candidates = objs.text_search(query, attributes, prefix)
+            elif grams:
+                postings = cls._class_trigrams()
+                lists = sorted((postings.get(gram, {}) for gram in grams),
+                               key=len)
+                candidates = [objs[obj_id] for obj_id in lists[0]
+                              if all(obj_id in ids for ids in lists[1:])]
+            return list(filter(_match, candidates))
+
+
+def _flush_on_signal(signum: int, frame):
+    """ Flush pending writes, then defer to the previous handler
+    """
+    Base.flush_pending()
+    previous = PREVIOUS_HANDLERS.get(signum)
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        raise SystemExit(128 + signum)
+
+
+def _flush_periodically():
+    """ Flusher thread body for the "interval" durability mode
+    """
+    while True:
+        time.sleep(DURABILITY_INTERVAL_MS / 1000)
+        Base.flush_pending()
+
+
+PREVIOUS_HANDLERS = {}
+FLUSH_HOOKS = False
+
+
+def start_flusher():
+    """ Start the background flusher thread in "interval" mode, on the
+    first deferred write, and the flush hooks if DURABILITY was only
+    set after import
+    """
+    global FLUSHER
+    if FLUSHER is not None:
+        return
+    install_flush_hooks()
+    FLUSHER = threading.Thread(target=_flush_periodically, daemon=True)
+    if DURABILITY == "interval":
+        FLUSHER.start()
+
+
+def install_flush_hooks():
+    """ Flush the deferred writes at exit and on SIGTERM/SIGINT; signal
+    handlers can only be set from the main thread, hence at import
+    """
+    global FLUSH_HOOKS
+    if FLUSH_HOOKS:
+        return
+    FLUSH_HOOKS = True
+    atexit.register(Base.flush_pending)
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        PREVIOUS_HANDLERS[signum] = signal.getsignal(signum)
+        signal.signal(signum, _flush_on_signal)
+
+
+if DURABILITY != "sync":
+    install_flush_hooks()